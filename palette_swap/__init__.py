@@ -2,8 +2,11 @@
 The common functions used by all palette swap procedures.
 """
 # -*- coding: utf-8 -*-
-from collections import defaultdict
-from typing import Dict, List, Tuple
+import sys
+from array import array
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
 
 # --- DEBUG ---
 # import debugpy
@@ -31,6 +34,23 @@ from gi.repository import GimpUi
 from gi.repository import GObject
 from gi.repository import GLib
 from gi.repository import Gegl
+gi.require_version('Babl', '0.1')
+from gi.repository import Babl
+
+from palette_swap.pixels import (
+    ALPHA_MASK, CHUNK_ROWS, RGB_MASK,
+    count_pixels, deduplicate_tiles, expand_colour_map, get_tile, iterate_tiles, map_pixels, put_tile,
+    union_bounds,
+)
+
+# Pixels are read and written as 8-bit R'G'B'A, packed into one unsigned int each.
+PIXEL_FORMAT: str = "R'G'B'A u8"
+# Images at these precisions can be read as PIXEL_FORMAT without losing anything.
+PRECISIONS_U8: Tuple[Gimp.Precision, ...] = (
+    Gimp.Precision.U8_LINEAR, Gimp.Precision.U8_NON_LINEAR, Gimp.Precision.U8_PERCEPTUAL
+)
+# Masks are read as one byte per pixel.
+MASK_FORMAT: str = "Y u8"
 
 
 def rgb_to_brightness(colour_rgb: Tuple[float, float, float]) -> float:
@@ -65,7 +85,7 @@ def extract_linear_palette(
     sorted_palette = []
     for index_width in range(0, layer.get_width()):
         sorted_palette.append(
-            layer.get_pixel(0, index_width).get_rgba()[0:3]
+            layer.get_pixel(index_width, 0).get_rgba()[0:3]
         )
 
     sorted_palette.reverse()
@@ -73,48 +93,91 @@ def extract_linear_palette(
     return sorted_palette
 
 
-def extract_sorted_palette(
+def count_palette(
     layer: Gimp.Layer,
     include_transparent: bool,
-    count_threshold: int,
     current_progress: float,
     progress_fraction: float,
-) -> List[Tuple[float, float, float]]:
+    tile_size: int = 0,
+    workers: int = 1,
+) -> Dict[Tuple[float, float, float], int]:
     """
-    Extracts a palette from an image, by finding the discrete RGB values
-    and then sorting them by total R+G+B value.
+    Counts the number of pixels of each discrete RGB value in a layer.
 
-    For some reason, passing around Gegl.Color seems to mess up,
-    so doing it in RGB values.
+    Layers in images that aren't 8-bit are read pixel by pixel at their own precision instead,
+    so the colours found still match the pixels exactly. Tiles and workers aren't used for those.
 
     :param layer: The layer to extract from.
+    :param include_transparent: Whether to sample colours from transparent pixels.
     :param current_progress: The current % of the progress bar.
     :param progress_fraction: The % of the progress bar this functions should cover.
-    :param include_transparent: Whether to sample colours from transparent pixels.
-    :param count_threshold: Whether to ignore colours with < that many pixels.
-    :return: The palette, as a list of RGB colours.
+    :param tile_size: If > 0, only count each distinct tile of this size once.
+    :param workers: The number of processes to split large layers across, or 0 for one per core.
+    :return: The pixel count for each RGB colour.
     """
-    # print("Extracting sorted palette...")
+    if layer.get_image().get_precision() not in PRECISIONS_U8:
+        return count_palette_native(layer, include_transparent, current_progress, progress_fraction)
+
+    with open_layer_pixels(layer, workers) as (pixels, memory_name):
+        pixel_counts: Counter = count_pixels(
+            pixels, layer.get_width(), layer.get_height(), tile_size, workers, memory_name
+        )
+    Gimp.progress_update(current_progress + progress_fraction * 0.5)
+
+    palette_counts: defaultdict = defaultdict(int)
+    for pixel, pixel_count in pixel_counts.items():
+        if include_transparent or pixel & ALPHA_MASK:
+            palette_counts[pixel & RGB_MASK] += pixel_count
+
+    Gimp.progress_update(current_progress + progress_fraction)
+    return {
+        pixel_to_rgb(pixel): pixel_count for pixel, pixel_count in palette_counts.items()
+    }
+
 
+def count_palette_native(
+    layer: Gimp.Layer,
+    include_transparent: bool,
+    current_progress: float,
+    progress_fraction: float,
+) -> Dict[Tuple[float, float, float], int]:
+    """
+    Counts the number of pixels of each discrete RGB value in a layer, one pixel at a time,
+    at the layer's own precision.
+
+    :param layer: The layer to extract from.
+    :param include_transparent: Whether to sample colours from transparent pixels.
+    :param current_progress: The current % of the progress bar.
+    :param progress_fraction: The % of the progress bar this functions should cover.
+    :return: The pixel count for each RGB colour.
+    """
     palette_counts: defaultdict = defaultdict(int)
     progress_step: float = progress_fraction / layer.get_height()
 
     for index_height in range(0, layer.get_height()):
         for index_width in range(0, layer.get_width()):
-            pixel_colour = layer.get_pixel(
-                index_width, index_height
-            )
-            pixel_rgba = pixel_colour.get_rgba()
-
-            if include_transparent or layer.has_alpha() and pixel_rgba[3] > 0:
+            pixel_rgba = layer.get_pixel(index_width, index_height).get_rgba()
+            if include_transparent or pixel_rgba[3] > 0:
                 palette_counts[pixel_rgba[0:3]] += 1
 
         Gimp.progress_update(current_progress + progress_step * index_height)
 
-    # print(f"Sorted through pixels to build defaultdict: {palette_counts}")
+    return dict(palette_counts)
 
-    # Now we've counted all the pixel colours, sort and discard outliers.
-    palette: Dict[Tuple[float, float, float]] = {}
+
+def sort_palette_counts(
+    palette_counts: Dict[Tuple[float, float, float], int],
+    count_threshold: int,
+) -> List[Tuple[Tuple[float, float, float], int]]:
+    """
+    Sorts counted colours by brightness, discarding outliers.
+
+    :param palette_counts: The pixel count for each RGB colour.
+    :param count_threshold: Whether to ignore colours with < that many pixels.
+    :return: The palette, as a list of RGB colours and their pixel counts.
+    :raises KeyError: If two colours have the same brightness.
+    """
+    palette: Dict[float, Tuple[float, float, float]] = {}
     for colour_rgb, colour_count in palette_counts.items():
         colour_brightness = rgb_to_brightness(colour_rgb)
 
@@ -131,10 +194,64 @@ def extract_sorted_palette(
             else:
                 palette[colour_brightness] = colour_rgb
 
-    sorted_palette = [
-        palette[key] for key in sorted(list(palette.keys()))
+    return [
+        (palette[key], palette_counts[palette[key]]) for key in sorted(list(palette.keys()))
     ]
-    return sorted_palette
+
+
+def extract_sorted_palette(
+    layer: Gimp.Layer,
+    include_transparent: bool,
+    count_threshold: int,
+    current_progress: float,
+    progress_fraction: float,
+    tile_size: int = 0,
+    workers: int = 1,
+) -> List[Tuple[float, float, float]]:
+    """
+    Extracts a palette from an image, by finding the discrete RGB values
+    and then sorting them by total R+G+B value.
+
+    For some reason, passing around Gegl.Color seems to mess up,
+    so doing it in RGB values.
+
+    :param layer: The layer to extract from.
+    :param current_progress: The current % of the progress bar.
+    :param progress_fraction: The % of the progress bar this functions should cover.
+    :param include_transparent: Whether to sample colours from transparent pixels.
+    :param count_threshold: Whether to ignore colours with < that many pixels.
+    :param tile_size: If > 0, only count each distinct tile of this size once.
+    :param workers: The number of processes to split large layers across, or 0 for one per core.
+    :return: The palette, as a list of RGB colours.
+    """
+    # print("Extracting sorted palette...")
+
+    palette_counts = count_palette(
+        layer=layer,
+        include_transparent=include_transparent,
+        current_progress=current_progress,
+        progress_fraction=progress_fraction,
+        tile_size=tile_size,
+        workers=workers,
+    )
+
+    # print(f"Sorted through pixels to build defaultdict: {palette_counts}")
+
+    # Now we've counted all the pixel colours, sort and discard outliers.
+    return [
+        colour_rgb for colour_rgb, _ in sort_palette_counts(palette_counts, count_threshold)
+    ]
+
+
+def rgb_to_colour(colour_rgb: Tuple[float, float, float]) -> Gegl.Color:
+    """
+    Converts an RGB value back into a Gegl.Color, fully opaque.
+
+    :param colour_rgb: The RGB colour, as a tuple.
+    """
+    return Gegl.Color.new(
+        f"rgba({colour_rgb[0]},{colour_rgb[1]},{colour_rgb[2]},1)"
+    )
 
 
 def apply_palette_map(
@@ -144,10 +261,17 @@ def apply_palette_map(
     sorted_palette_new: List[Tuple[float, float, float]],
     current_progress: float,
     progress_fraction: float,
+    flush_displays: bool = True,
+    tile_size: int = 0,
+    workers: int = 1,
+    engine: str = 'select-fill',
 ):
     """
     Applies a colour mapping as given in two palette arrays.
 
+    If there's a selection, only the selected part of the layer is changed, whichever the engine.
+    The selection and foreground colour are left as they were.
+
     :param image: The current image.
     :param layer: The layer to extract from.
     :param sorted_palette_old: The old palette, colours to be replaced.
@@ -156,7 +280,45 @@ def apply_palette_map(
     :param progress_fraction: The % of the progress bar this functions should cover.
     :param include_transparent: Whether to sample colours from transparent pixels.
     :param count_threshold: Whether to ignore colours with < that many pixels.
+    :param flush_displays: Whether to refresh the displays once done.
+    :param tile_size: When rewriting pixels, only remap each distinct tile of this size once, if > 0.
+    :param workers: When rewriting pixels, the number of processes to split large layers across, or 0 for one per core.
+    :param engine: How to apply the map; 'select-fill' selects and fills each colour in turn,
+        'indexed' edits the image's colormap, and anything else rewrites the layer's pixels directly.
+        See `palette_swap.engine`.
     """
+    if engine == 'indexed':
+        apply_palette_colormap(
+            image=image,
+            sorted_palette_old=sorted_palette_old,
+            sorted_palette_new=sorted_palette_new,
+        )
+        Gimp.progress_update(current_progress + progress_fraction)
+        if flush_displays:
+            Gimp.displays_flush()
+        return
+
+    elif engine != 'select-fill':
+        remap_layer(
+            layer=layer,
+            colour_map={
+                rgb_to_pixel(colour_old): rgb_to_pixel(colour_new)
+                for colour_old, colour_new in zip(sorted_palette_old, sorted_palette_new)
+            },
+            tile_size=tile_size,
+            workers=workers,
+        )
+        Gimp.progress_update(current_progress + progress_fraction)
+        if flush_displays:
+            Gimp.displays_flush()
+        return
+
+    # Selecting and filling changes the selection and foreground colour, so remember them.
+    original_foreground: Gegl.Color = Gimp.context_get_foreground()
+    original_selection: Optional[Gimp.Channel] = None
+    if not Gimp.Selection.is_empty(image):
+        original_selection = Gimp.Selection.save(image)
+
     for index_colour, colour_old, colour_new in zip(
         range(0, len(sorted_palette_old)),
         sorted_palette_old,
@@ -165,19 +327,263 @@ def apply_palette_map(
         # print(f"Filling {colour_old} with {colour_new}")
         progress_step: float = progress_fraction / len(sorted_palette_old)
 
+        # Only swap within the selection, if there is one, as the other engines do.
+        if original_selection is not None:
+            image.select_item(Gimp.ChannelOps.REPLACE, original_selection)
         image.select_color(
-            Gimp.ChannelOps.REPLACE,
+            Gimp.ChannelOps.REPLACE if original_selection is None else Gimp.ChannelOps.INTERSECT,
             layer,
-            Gegl.Color.new(
-                f"rgba({colour_old[0]},{colour_old[1]},{colour_old[2]},1)"
-            )
+            rgb_to_colour(colour_old)
         )
-        Gimp.context_set_foreground(
-            Gegl.Color.new(
-                f"rgba({colour_new[0]},{colour_new[1]},{colour_new[2]},1)"
+        # Filling with nothing selected would fill the whole layer.
+        if not Gimp.Selection.is_empty(image):
+            Gimp.context_set_foreground(
+                rgb_to_colour(colour_new)
             )
-        )
-        layer.edit_fill(Gimp.FillType.FOREGROUND)
+            layer.edit_fill(Gimp.FillType.FOREGROUND)
         Gimp.progress_update(current_progress + progress_step * index_colour)
 
-    Gimp.displays_flush()
+    Gimp.context_set_foreground(original_foreground)
+    if original_selection is not None:
+        image.select_item(Gimp.ChannelOps.REPLACE, original_selection)
+        image.remove_channel(original_selection)
+    else:
+        Gimp.Selection.none(image)
+
+    if flush_displays:
+        Gimp.displays_flush()
+
+
+def apply_palette_colormap(
+    image: Gimp.Image,
+    sorted_palette_old: List[Tuple[float, float, float]],
+    sorted_palette_new: List[Tuple[float, float, float]],
+):
+    """
+    Applies a colour mapping to an indexed image by editing its colormap, without touching any pixels.
+
+    This recolours every layer in the image.
+
+    :param image: The current image, in indexed mode.
+    :param sorted_palette_old: The old palette, colours to be replaced.
+    :param sorted_palette_new: The new palette, colours to replace them with.
+    """
+    colour_map: Dict[int, Tuple[float, float, float]] = {
+        rgb_to_pixel(colour_old): colour_new
+        for colour_old, colour_new in zip(sorted_palette_old, sorted_palette_new)
+    }
+
+    colormap: Gimp.Palette = image.get_palette()
+    for index_entry in range(0, colormap.get_color_count()):
+        colour_entry = rgb_to_pixel(colormap.get_entry_color(index_entry).get_rgba()[0:3])
+        if colour_entry in colour_map:
+            colormap.set_entry_color(index_entry, rgb_to_colour(colour_map[colour_entry]))
+
+
+def pixel_to_rgb(pixel: int) -> Tuple[float, float, float]:
+    """
+    Converts a packed pixel into an RGB value, in the same space as `Gegl.Color.get_rgba`.
+
+    :param pixel: The pixel, packed as in `read_layer_pixels`.
+    :return: The RGB colour, as a tuple.
+    """
+    colour = Gegl.Color.new("black")
+    colour.set_bytes(
+        Babl.format(PIXEL_FORMAT), GLib.Bytes.new(pixel.to_bytes(4, sys.byteorder))
+    )
+    return colour.get_rgba()[0:3]
+
+
+def rgb_to_pixel(colour_rgb: Tuple[float, float, float]) -> int:
+    """
+    Converts an RGB value into a packed pixel, with zero alpha so it can be OR'd with the original.
+
+    :param colour_rgb: The RGB colour, as a tuple.
+    :return: The pixel, packed as in `read_layer_pixels`.
+    """
+    colour = Gegl.Color.new("black")
+    colour.set_rgba(colour_rgb[0], colour_rgb[1], colour_rgb[2], 1.0)
+    pixel_bytes: bytes = colour.get_bytes(Babl.format(PIXEL_FORMAT)).get_data()
+    return int.from_bytes(pixel_bytes, sys.byteorder) & RGB_MASK
+
+
+def read_layer_pixels(
+    layer: Gimp.Layer,
+    pixels: Optional[array] = None,
+) -> array:
+    """
+    Reads every pixel of a layer from its buffer, a chunk of rows at a time.
+
+    :param layer: The layer to read.
+    :param pixels: Somewhere to read the pixels into, e.g. shared memory cast to 'I'. Defaults to a new array.
+    :return: The pixels, row by row, each packed into an unsigned int.
+    """
+    width, height = layer.get_width(), layer.get_height()
+    if pixels is None:
+        pixels = array('I', [0]) * (width * height)
+
+    buffer: Gegl.Buffer = layer.get_buffer()
+    with memoryview(pixels) as pixels_view, pixels_view.cast('B') as pixels_bytes:
+        for row_start in range(0, height, CHUNK_ROWS):
+            row_stop: int = min(row_start + CHUNK_ROWS, height)
+            pixels_bytes[row_start * width * pixels_view.itemsize:row_stop * width * pixels_view.itemsize] = buffer.get(
+                Gegl.Rectangle.new(0, row_start, width, row_stop - row_start),
+                1.0, PIXEL_FORMAT, Gegl.AbyssPolicy.CLAMP
+            )
+    return pixels
+
+
+@contextmanager
+def open_layer_pixels(
+    layer: Gimp.Layer,
+    workers: int = 1,
+) -> Iterator[Tuple[array, Optional[str]]]:
+    """
+    Reads every pixel of a layer, for the length of a `with` block.
+
+    If the layer's big enough to be split across processes, it's read straight into shared memory,
+    so the processes can work on it in place and there's only ever one copy of the pixels.
+    The pixels must not be kept past the end of the block.
+
+    :param layer: The layer to read.
+    :param workers: The number of processes the pixels will be split across, or 0 for one per core.
+    :return: The pixels, and the name of the shared memory holding them, or None if they're in an ordinary array.
+    """
+    width, height = layer.get_width(), layer.get_height()
+    if workers != 1:
+        from palette_swap import parallel
+        if parallel.get_worker_count(workers, width * height) > 1:
+            with parallel.shared_pixels(width * height) as (memory_name, pixels_shared):
+                yield read_layer_pixels(layer, pixels_shared), memory_name
+            return
+
+    yield read_layer_pixels(layer), None
+
+
+def read_palette_row(layer: Gimp.Layer) -> List[int]:
+    """
+    Reads the colours of a 1-pixel-high palette layer, from left to right.
+
+    :param layer: The palette layer. Only its top row is read.
+    :return: The colours, as packed pixels with no alpha.
+    """
+    return [pixel & RGB_MASK for pixel in read_layer_pixels(layer)[0:layer.get_width()]]
+
+
+def read_mask_values(mask: Gimp.Channel, layer: Gimp.Layer) -> bytes:
+    """
+    Reads the values of a channel or layer mask over the area covered by a layer.
+
+    Channels cover the whole image, so are read at the layer's offsets.
+    Layer masks are the same size as their layer, so are read from their origin;
+    they must be the layer's own mask, or they won't line up.
+    Anything outside the mask counts as unselected.
+
+    :param mask: The channel or layer mask to read.
+    :param layer: The layer whose area to read.
+    :return: The mask value for each of the layer's pixels, row by row.
+    """
+    if isinstance(mask, Gimp.LayerMask):
+        offset_x, offset_y = 0, 0
+    else:
+        _, offset_x, offset_y = layer.get_offsets()
+
+    buffer: Gegl.Buffer = mask.get_buffer()
+    return buffer.get(
+        Gegl.Rectangle.new(offset_x, offset_y, layer.get_width(), layer.get_height()),
+        1.0, MASK_FORMAT, Gegl.AbyssPolicy.NONE
+    )
+
+
+def write_layer_pixels(
+    layer: Gimp.Layer,
+    pixels: array,
+    bounds: Optional[Tuple[int, int, int, int]] = None,
+):
+    """
+    Writes every pixel of a layer through its shadow buffer, a chunk of rows at a time,
+    then merges it back in one go.
+
+    The shadow buffer starts out empty, so has to be written in full,
+    but only the area that's actually changed needs redrawing.
+    If there's a selection, only the selected part of the layer is changed.
+
+    :param layer: The layer to write to.
+    :param pixels: The pixels, as from `read_layer_pixels`.
+    :param bounds: The x, y, width and height of the area that's changed. Defaults to the whole layer.
+    """
+    width, height = layer.get_width(), layer.get_height()
+    shadow: Gegl.Buffer = layer.get_shadow_buffer()
+    with memoryview(pixels) as pixels_view:
+        for row_start in range(0, height, CHUNK_ROWS):
+            row_stop: int = min(row_start + CHUNK_ROWS, height)
+            shadow.set(
+                Gegl.Rectangle.new(0, row_start, width, row_stop - row_start),
+                PIXEL_FORMAT, pixels_view[row_start * width:row_stop * width].tobytes()
+            )
+    shadow.flush()
+    layer.merge_shadow(True)
+
+    if bounds is None:
+        bounds = (0, 0, layer.get_width(), layer.get_height())
+    layer.update(*bounds)
+
+
+def build_brightness_lut(
+    sorted_palette: List[Tuple[float, float, float]],
+    lut_size: int,
+) -> List[int]:
+    """
+    Builds a lookup table from brightness to colour, interpolating between the palette colours.
+
+    The palette colours are spread evenly from the darkest entry to the lightest.
+
+    :param sorted_palette: The palette, sorted from darkest to lightest.
+    :param lut_size: The number of entries in the table.
+    :return: The packed pixel for each brightness step, darkest first.
+    :raises ValueError: If the palette is empty.
+    """
+    if not sorted_palette:
+        raise ValueError("Palette has no colours!")
+
+    if len(sorted_palette) == 1:
+        return [rgb_to_pixel(sorted_palette[0])] * lut_size
+
+    lut: List[int] = []
+    for index_lut in range(0, lut_size):
+        position: float = index_lut / (lut_size - 1) * (len(sorted_palette) - 1)
+        index_stop: int = min(int(position), len(sorted_palette) - 2)
+        fraction: float = position - index_stop
+        colour_dark, colour_light = sorted_palette[index_stop], sorted_palette[index_stop + 1]
+        lut.append(
+            rgb_to_pixel(tuple(
+                dark + (light - dark) * fraction for dark, light in zip(colour_dark, colour_light)
+            ))
+        )
+    return lut
+
+
+def remap_layer(
+    layer: Gimp.Layer,
+    colour_map: Dict[int, int],
+    tile_size: int,
+    workers: int = 1,
+):
+    """
+    Replaces colours in a layer by rewriting its pixels, keeping their transparency.
+
+    The pixels are written once through the shadow buffer, so the whole swap is a single undo step.
+    If there's a selection, only the selected part of the layer is changed.
+
+    :param layer: The layer to recolour.
+    :param colour_map: The new colour for each colour to be replaced, as packed pixels with no alpha.
+    :param tile_size: If > 0, only map each distinct tile of this size once, and copy it to the repeats.
+    :param workers: The number of processes to split large layers across, or 0 for one per core.
+    """
+    width, height = layer.get_width(), layer.get_height()
+    with open_layer_pixels(layer, workers) as (pixels, memory_name):
+        pixel_map: Dict[int, int] = expand_colour_map(pixels, colour_map)
+        # If nothing's changed, don't leave an empty step on the undo stack.
+        if pixel_map:
+            bounds = map_pixels(pixels, width, height, pixel_map, tile_size, workers, memory_name)
+            write_layer_pixels(layer, pixels, bounds)
@@ -0,0 +1,143 @@
+"""
+The worker side of the batch runner, `ttt-palette-swap-batch.py`.
+
+This is run inside a long-lived `gimp-console` process, using the `python-fu-eval`
+batch interpreter. It connects back to the batch runner, and then loads, swaps
+and saves files one job at a time until it is told to stop.
+"""
+# -*- coding: utf-8 -*-
+import time
+from multiprocessing.connection import Client
+from typing import Dict, Tuple
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+from gi.repository import Gio
+from gi.repository import GObject
+
+
+def read_error_message(
+    job: Dict[str, object],
+    return_values: Gimp.ValueArray,
+) -> str:
+    """
+    Reads why a procedure failed from its return values.
+
+    Procedures that fail with an error put its message after the status.
+
+    :param job: The job that was run.
+    :param return_values: The values returned by the procedure.
+    :return: The error message, or a note of the status if there isn't one.
+    """
+    if return_values.length() > 1:
+        error_message = return_values.index(1)
+        if isinstance(error_message, str) and error_message:
+            return error_message
+
+    return f"{job['procedure']} returned {return_values.index(0).value_nick} without a message"
+
+
+def run_job(
+    job: Dict[str, object],
+) -> Dict[str, object]:
+    """
+    Loads a file, runs one of the palette swap procedures on it, and saves the output.
+
+    Options that are layer arguments, like `layer-sample`, are given as layer names
+    and looked up in the loaded image. Defaults are only applied to procedures that have the argument.
+
+    :param job: The job, with `file`, `output`, `procedure`, `options`, and optional `layer` and `defaults` keys.
+    :return: The job's result, with `file`, `output`, `status`, `error` and `seconds` keys.
+    """
+    time_start: float = time.perf_counter()
+    result: Dict[str, object] = {
+        'file': job['file'],
+        'output': job['output'],
+        'status': 'SUCCESS',
+        'error': None,
+    }
+
+    image: Gimp.Image = None
+    try:
+        image = Gimp.file_load(
+            Gimp.RunMode.NONINTERACTIVE, Gio.File.new_for_path(job['file'])
+        )
+
+        if job.get('layer'):
+            layer_target: Gimp.Layer = image.get_layer_by_name(job['layer'])
+            if layer_target is None:
+                raise KeyError(f"No layer called '{job['layer']}' in {job['file']}")
+            image.set_selected_layers([layer_target])
+
+        procedure: Gimp.Procedure = Gimp.get_pdb().lookup_procedure(job['procedure'])
+        if procedure is None:
+            raise KeyError(f"No procedure called '{job['procedure']}'")
+
+        config = procedure.create_config()
+        config.set_property('run-mode', Gimp.RunMode.NONINTERACTIVE)
+        config.set_property('image', image)
+        config.set_core_object_array('drawables', image.get_selected_layers())
+
+        options: Dict[str, object] = {
+            option_name: option_value for option_name, option_value in job.get('defaults', {}).items()
+            if procedure.find_argument(option_name) is not None
+        }
+        options.update(job.get('options', {}))
+        for option_name, option_value in options.items():
+            option_spec = procedure.find_argument(option_name)
+            if option_spec is None:
+                raise KeyError(f"{job['procedure']} has no argument called '{option_name}'")
+
+            if GObject.type_is_a(option_spec.value_type, Gimp.Drawable):
+                option_layer = image.get_layer_by_name(option_value)
+                if option_layer is None:
+                    raise KeyError(f"No layer called '{option_value}' in {job['file']}")
+                option_value = option_layer
+
+            config.set_property(option_name, option_value)
+
+        return_values = procedure.run(config)
+        status: Gimp.PDBStatusType = return_values.index(0)
+        if status != Gimp.PDBStatusType.SUCCESS:
+            result['status'] = status.value_nick.upper()
+            result['error'] = read_error_message(job, return_values)
+        else:
+            Gimp.file_save(
+                Gimp.RunMode.NONINTERACTIVE, image, Gio.File.new_for_path(job['output']), None
+            )
+
+    except Exception as e:
+        result['status'] = 'ERROR'
+        result['error'] = f"{e}"
+
+    finally:
+        if image is not None:
+            image.delete()
+
+    result['seconds'] = time.perf_counter() - time_start
+    return result
+
+
+def serve(
+    address: Tuple[str, int],
+    authkey: bytes,
+    worker_index: int,
+):
+    """
+    Connects to the batch runner and runs jobs from it until sent `None`.
+
+    :param address: The host and port the batch runner is listening on.
+    :param authkey: The key shared with the batch runner.
+    :param worker_index: Which of the batch runner's workers this is, so it can tell if this process dies.
+    """
+    connection = Client(address, authkey=authkey)
+    try:
+        connection.send(worker_index)
+        while True:
+            job = connection.recv()
+            if job is None:
+                break
+            connection.send(run_job(job))
+    finally:
+        connection.close()
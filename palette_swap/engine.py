@@ -0,0 +1,386 @@
+"""
+Picks the fastest way to run a palette swap or extraction, based on the layer and palettes.
+
+The engines are:
+
+* `select-fill`: Selects and fills each colour in turn. Costs a whole-layer pass per colour.
+* `lut`: Reads the layer's pixels, maps them through a lookup table, and writes them back in one pass.
+* `tiled`: As `lut`, but only maps each distinct tile once. Fast for sprite sheets and tilemaps.
+* `parallel`: As `lut`, but splits very large layers across several processes.
+* `indexed`: Edits the colormap of an indexed image, without touching any pixels.
+"""
+# -*- coding: utf-8 -*-
+import json
+import os
+import platform
+import random
+import time
+from array import array
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+from gi.repository import Gegl
+
+from palette_swap import (
+    PRECISIONS_U8,
+    deduplicate_tiles, map_pixels, read_layer_pixels, write_layer_pixels, rgb_to_colour,
+)
+from palette_swap.parallel import get_worker_count
+
+ENGINES: List[str] = ['select-fill', 'lut', 'tiled', 'parallel', 'indexed']
+ENGINES_EXTRACT: List[str] = ['lut', 'tiled', 'parallel']
+
+# Costs, in seconds, that aren't measured by `calibrate`.
+# Starting a worker would take as long to time as it saves, so this is a rough figure
+# for starting a Python process and importing this package on a typical desktop.
+PARALLEL_SECONDS_PER_WORKER: float = 0.5
+# Editing a colormap entry is near-instant; any small figure has it picked whenever it can be used.
+INDEXED_SECONDS_PER_COLOUR: float = 0.001
+
+# The sizes of the scratch layers `calibrate` times selecting, filling, reading and writing on.
+# Per-pixel costs are told apart from fixed ones by the difference, so the large one has to be big enough to dominate.
+CALIBRATION_SIZE_SMALL: int = 32
+CALIBRATION_SIZE_LARGE: int = 1024
+# Each timing is the fastest of this many runs, so one slow run doesn't skew it.
+CALIBRATION_RUNS: int = 3
+# The timings `calibrate` measures, and where they're saved in GIMP's user folder.
+TIMING_NAMES: List[str] = ['map', 'tile', 'select_fill_pixel', 'select_fill_colour', 'buffer']
+CALIBRATION_FILE_NAME: str = 'ttt-palette-swap-calibration.json'
+
+# Sprite sheets and tilemaps are assumed to be mostly repeats.
+TILED_UNIQUE_FRACTION: float = 0.25
+# Used when the `tiled` engine is requested without a tile size.
+TILED_DEFAULT_SIZE: int = 16
+
+# Measured or loaded once per process by `calibrate`.
+_calibration: Dict[str, float] = {}
+
+
+class EnginePlan(NamedTuple):
+    """
+    The engine chosen for a job, and the settings to run it with.
+    """
+    engine: str
+    tile_size: int
+    workers: int
+    reason: str
+
+
+def time_best(
+    function: Callable[[], None],
+) -> float:
+    """
+    Times a function, as the fastest of a few runs after an untimed one to warm up.
+
+    :param function: The function to time.
+    :return: The seconds taken by the fastest run.
+    """
+    function()
+    seconds: List[float] = []
+    for _ in range(0, CALIBRATION_RUNS):
+        time_start: float = time.perf_counter()
+        function()
+        seconds.append(time.perf_counter() - time_start)
+    return min(seconds)
+
+
+def time_select_fill(
+    image: Gimp.Image,
+    size: int,
+) -> Tuple[float, Gimp.Layer]:
+    """
+    Times selecting and filling one colour on a new scratch layer.
+
+    The layer starts out black, and each run swaps it between black and white,
+    so every run selects and fills the whole layer.
+
+    :param image: The scratch image to add the layer to.
+    :param size: The width and height of the layer.
+    :return: The seconds taken, and the layer.
+    """
+    layer: Gimp.Layer = Gimp.Layer.new(
+        image, "Calibration", size, size, Gimp.ImageType.RGBA_IMAGE, 100, Gimp.LayerMode.NORMAL
+    )
+    image.insert_layer(layer, None, 0)
+
+    colours: List[Gegl.Color] = [rgb_to_colour((0, 0, 0)), rgb_to_colour((1, 1, 1))]
+    Gimp.Selection.none(image)
+    Gimp.context_set_foreground(colours[0])
+    layer.edit_fill(Gimp.FillType.FOREGROUND)
+
+    def select_fill():
+        image.select_color(Gimp.ChannelOps.REPLACE, layer, colours[0])
+        Gimp.context_set_foreground(colours[1])
+        layer.edit_fill(Gimp.FillType.FOREGROUND)
+        colours.reverse()
+
+    return time_best(select_fill), layer
+
+
+def calibration_key() -> List[str]:
+    """
+    Identifies the setup saved timings were measured on, so they're measured again if it changes.
+
+    :return: The GIMP and Python versions, and the calibration settings.
+    """
+    return [
+        Gimp.version(), platform.python_version(),
+        f"{CALIBRATION_SIZE_SMALL} {CALIBRATION_SIZE_LARGE} {CALIBRATION_RUNS}",
+    ]
+
+
+def load_calibration() -> Optional[Dict[str, float]]:
+    """
+    Loads the timings saved by an earlier `calibrate`, if they were measured on the same setup.
+
+    :return: The timings, or None if there aren't any usable ones.
+    """
+    try:
+        with open(os.path.join(Gimp.directory(), CALIBRATION_FILE_NAME), 'r') as file_calibration:
+            saved: dict = json.load(file_calibration)
+    except (OSError, ValueError):
+        return None
+
+    if not isinstance(saved, dict) or saved.get('key') != calibration_key():
+        return None
+    timings = saved.get('timings')
+    if not isinstance(timings, dict) or set(timings) != set(TIMING_NAMES):
+        return None
+    return timings
+
+
+def save_calibration(timings: Dict[str, float]):
+    """
+    Saves timings from `calibrate` for later runs, which are each in a new process.
+
+    :param timings: The timings to save.
+    """
+    try:
+        with open(os.path.join(Gimp.directory(), CALIBRATION_FILE_NAME), 'w') as file_calibration:
+            json.dump({'key': calibration_key(), 'timings': timings}, file_calibration)
+    except OSError as e:
+        print(f"Couldn't save engine timings, they'll be measured again next time: {e}")
+
+
+def calibrate() -> Dict[str, float]:
+    """
+    Times each engine's work on scratch pixels and a scratch image, to work out their costs.
+
+    GIMP starts a new process for every run of a plug-in, so the timings are saved in GIMP's user folder,
+    and only measured again if GIMP, Python or the calibration settings change.
+    Within a process, later calls return the same timings.
+
+    :return: The seconds per pixel for `map`, `tile` and `buffer` (reading and writing a layer),
+        and the seconds per colour and per pixel per colour for `select_fill_colour` and `select_fill_pixel`.
+    """
+    if _calibration:
+        return _calibration
+
+    timings_saved: Optional[Dict[str, float]] = load_calibration()
+    if timings_saved is not None:
+        _calibration.update(timings_saved)
+        return _calibration
+
+    width: int = 256
+    tile_colours: List[int] = [random.randrange(0, 16) for _ in range(0, 16 * 16)]
+    pixels = array('I', [
+        tile_colours[(index_pixel // width % 16) * 16 + index_pixel % 16]
+        for index_pixel in range(0, width * width)
+    ])
+    # Swaps pairs of colours, so every run maps the same pixels.
+    pixel_map: Dict[int, int] = {colour: colour ^ 1 for colour in range(0, 8)}
+
+    _calibration['map'] = time_best(
+        lambda: map_pixels(pixels, width, width, pixel_map, 0)
+    ) / len(pixels)
+    _calibration['tile'] = time_best(
+        lambda: deduplicate_tiles(pixels, width, width, 16)
+    ) / len(pixels)
+
+    # Time GIMP's side on a scratch image, keeping the user's foreground colour.
+    Gimp.context_push()
+    image: Gimp.Image = Gimp.Image.new(CALIBRATION_SIZE_LARGE, CALIBRATION_SIZE_LARGE, Gimp.ImageBaseType.RGB)
+    try:
+        # Each colour costs a fixed amount, plus an amount per pixel, so time two sizes to tell them apart.
+        seconds_small, _ = time_select_fill(image, CALIBRATION_SIZE_SMALL)
+        seconds_large, layer = time_select_fill(image, CALIBRATION_SIZE_LARGE)
+        _calibration['select_fill_pixel'] = max(seconds_large - seconds_small, 0.0) / (
+            CALIBRATION_SIZE_LARGE ** 2 - CALIBRATION_SIZE_SMALL ** 2
+        )
+        _calibration['select_fill_colour'] = max(
+            seconds_small - _calibration['select_fill_pixel'] * CALIBRATION_SIZE_SMALL ** 2, 0.0
+        )
+
+        Gimp.Selection.none(image)
+        _calibration['buffer'] = time_best(
+            lambda: write_layer_pixels(layer, read_layer_pixels(layer))
+        ) / CALIBRATION_SIZE_LARGE ** 2
+    finally:
+        image.delete()
+        Gimp.context_pop()
+
+    save_calibration(_calibration)
+    return _calibration
+
+
+def can_rewrite_pixels(image: Gimp.Image) -> bool:
+    """
+    Whether an image's layers can be recoloured by rewriting their pixels.
+
+    Pixels are rewritten as 8-bit RGB, so would lose detail on higher-precision images,
+    and be snapped to the nearest colormap entry on indexed images.
+
+    :param image: The current image.
+    :return: True if the image is 8-bit RGB.
+    """
+    return image.get_base_type() == Gimp.ImageBaseType.RGB and image.get_precision() in PRECISIONS_U8
+
+
+def can_edit_colormap(image: Gimp.Image) -> bool:
+    """
+    Whether an image can be recoloured by editing its colormap.
+
+    The colormap is shared by every layer, and can't be limited to a selection,
+    so this only works for single-layer indexed images with nothing selected.
+
+    :param image: The current image.
+    :return: True if the image's colormap can be edited.
+    """
+    return (
+        image.get_base_type() == Gimp.ImageBaseType.INDEXED
+        and len(image.get_layers()) == 1 and Gimp.Selection.is_empty(image)
+    )
+
+
+def check_can_swap(image: Gimp.Image):
+    """
+    Checks any engine can swap an image's palette, before anything is changed.
+
+    :param image: The current image.
+    :raises ValueError: If the image is indexed, and its colormap can't be edited.
+    """
+    if image.get_base_type() == Gimp.ImageBaseType.INDEXED and not can_edit_colormap(image):
+        raise ValueError(
+            "Indexed images can only be swapped if they have a single layer and nothing selected. "
+            "Convert the image to RGB first."
+        )
+
+
+def estimate_costs(
+    image: Gimp.Image,
+    drawable: Gimp.Drawable,
+    palette_size: int,
+    workers: int,
+    extract_only: bool,
+) -> Dict[str, Optional[float]]:
+    """
+    Estimates how long each engine would take for a job.
+
+    :param image: The current image.
+    :param drawable: The layer to be swapped or extracted from.
+    :param palette_size: The number of colours to be swapped.
+    :param workers: The number of processes requested for the `parallel` engine, or 0 for one per core.
+    :param extract_only: Whether the job only reads the layer, rather than swapping it.
+    :return: The estimated seconds for each engine, or None for any that can't be used.
+    """
+    timings: Dict[str, float] = calibrate()
+    pixel_count: int = drawable.get_width() * drawable.get_height()
+    worker_count: int = get_worker_count(workers, pixel_count)
+    is_indexed: bool = image.get_base_type() == Gimp.ImageBaseType.INDEXED
+    can_rewrite: bool = extract_only or can_rewrite_pixels(image)
+
+    costs: Dict[str, Optional[float]] = {engine: None for engine in ENGINES}
+    if can_rewrite:
+        costs['lut'] = pixel_count * (timings['buffer'] + timings['map'])
+        costs['tiled'] = pixel_count * (
+            timings['buffer'] + timings['tile'] + timings['map'] * TILED_UNIQUE_FRACTION
+        )
+        # Small layers fall back to a single process, so just pay the cost of `lut`.
+        costs['parallel'] = pixel_count * (
+            timings['buffer'] + timings['map'] / worker_count
+        ) + (PARALLEL_SECONDS_PER_WORKER * worker_count if worker_count > 1 else 0)
+
+    if not extract_only:
+        # Filling an indexed layer snaps the new colours to the nearest colormap entry.
+        if not is_indexed:
+            costs['select-fill'] = palette_size * (
+                timings['select_fill_colour'] + timings['select_fill_pixel'] * pixel_count
+            )
+        if can_edit_colormap(image):
+            costs['indexed'] = palette_size * INDEXED_SECONDS_PER_COLOUR
+
+    return costs
+
+
+def plan_engine(
+    image: Gimp.Image,
+    drawable: Gimp.Drawable,
+    palette_size: int,
+    tile_size: int,
+    workers: int,
+    engine: str = 'auto',
+    extract_only: bool = False,
+) -> EnginePlan:
+    """
+    Picks the engine to use for a job, and logs the choice.
+
+    :param image: The current image.
+    :param drawable: The layer to be swapped or extracted from.
+    :param palette_size: The number of colours to be swapped.
+    :param tile_size: The tile size for the `tiled` engine, or 0 if the layer isn't made of tiles.
+    :param workers: The number of processes requested for the `parallel` engine, or 0 for one per core.
+    :param engine: The engine to use, or 'auto' to pick the one with the lowest estimated cost.
+    :param extract_only: Whether the job only reads the layer, rather than swapping it.
+    :return: The engine, and the tile size and worker count to use with it.
+    :raises ValueError: If the requested engine can't be used for this job, or no engine can.
+    """
+    is_tiled: bool = tile_size > 0
+    tile_size = tile_size if is_tiled else TILED_DEFAULT_SIZE
+
+    costs: Dict[str, Optional[float]] = estimate_costs(
+        image, drawable, palette_size, workers, extract_only
+    )
+    costs_valid: Dict[str, float] = {
+        engine_name: cost for engine_name, cost in costs.items() if cost is not None
+    }
+    job: str = (
+        f"{drawable.get_width()}x{drawable.get_height()}, {palette_size} colours, "
+        f"{image.get_precision().value_nick}, {image.get_base_type().value_nick}"
+        f"{', alpha' if drawable.has_alpha() else ''}"
+    )
+    estimates: str = ", ".join(
+        f"{engine_name} {cost:.3f}s" for engine_name, cost in sorted(costs_valid.items(), key=lambda item: item[1])
+    )
+
+    if not costs_valid:
+        raise ValueError(f"No engine can swap {drawable.get_name()} ({job}).")
+
+    elif engine == 'auto':
+        # Without a tile size, there's no telling if the layer repeats, so don't guess.
+        engine = min(
+            [engine_name for engine_name in costs_valid if is_tiled or engine_name != 'tiled'],
+            key=costs_valid.get
+        )
+        reason: str = f"lowest estimated cost for {job} ({estimates})"
+
+    elif extract_only and engine not in ENGINES_EXTRACT:
+        # Selecting and filling or editing the colormap only apply to swaps; reading is always by buffer.
+        reason = f"as '{engine}' only applies to swapping, not reading ({job})"
+        engine = 'lut'
+
+    elif engine not in costs_valid:
+        raise ValueError(f"The '{engine}' engine can't be used for {drawable.get_name()} ({job}).")
+
+    else:
+        reason = f"requested ({job}; estimates {estimates})"
+
+    plan = EnginePlan(
+        engine=engine,
+        tile_size=tile_size if engine == 'tiled' or (engine == 'parallel' and is_tiled) else 0,
+        workers=workers if engine == 'parallel' else 1,
+        reason=reason,
+    )
+    print(f"{drawable.get_name()}: using '{plan.engine}' engine, {plan.reason}")
+    return plan
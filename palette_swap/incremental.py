@@ -0,0 +1,204 @@
+"""
+Remembers the last swap made on each layer, so re-running it only redoes the parts that have been edited since.
+
+The last colour map, and a checksum for each tile of the swapped layer, are kept in a parasite on the layer.
+This is saved with the image, and rolled back along with the swap if it's undone.
+"""
+# -*- coding: utf-8 -*-
+import hashlib
+import json
+import zlib
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+
+from palette_swap import (
+    ALPHA_MASK, RGB_MASK,
+    iterate_tiles, get_tile, put_tile, rgb_to_pixel, read_layer_pixels, union_bounds, write_layer_pixels,
+)
+from palette_swap.engine import can_rewrite_pixels
+
+PARASITE_NAME: str = 'ttt-palette-swap-state'
+# Small enough that touch-ups only redo a little, large enough to keep the parasite small.
+STATE_TILE_SIZE: int = 64
+
+
+def swap_state_key(*settings) -> str:
+    """
+    Summarises the settings of a swap, so a later run can tell if it's the same swap.
+
+    :param settings: Anything that affects the colour map, e.g. the new palette and options.
+    :return: A hash of the settings.
+    """
+    return hashlib.sha1(json.dumps(settings).encode()).hexdigest()
+
+
+def tile_checksums(
+    pixels: array,
+    width: int,
+    height: int,
+) -> List[int]:
+    """
+    Checksums each tile of a layer.
+
+    :param pixels: The layer's pixels, as from `read_layer_pixels`.
+    :param width: The width of the layer.
+    :param height: The height of the layer.
+    :return: The checksum of each tile, in the order of `iterate_tiles`.
+    """
+    return [
+        zlib.crc32(get_tile(pixels, width, tile).tobytes())
+        for tile in iterate_tiles(width, height, STATE_TILE_SIZE)
+    ]
+
+
+def load_swap_state(layer: Gimp.Layer) -> Optional[dict]:
+    """
+    Loads the state of the last swap on a layer.
+
+    :param layer: The layer.
+    :return: The state, as saved by `save_swap_state`, or None if the layer hasn't been swapped.
+    """
+    parasite: Gimp.Parasite = layer.get_parasite(PARASITE_NAME)
+    if parasite is None:
+        return None
+    return json.loads(zlib.decompress(bytes(parasite.get_data())))
+
+
+def save_swap_state(
+    image: Gimp.Image,
+    layer: Gimp.Layer,
+    state_key: str,
+    colour_map: Dict[int, int],
+    pixels: Optional[array] = None,
+):
+    """
+    Saves the state of a swap on a layer, so the next run can tell which tiles have changed.
+
+    Swaps limited to a selection leave the rest of the layer unswapped, so forget any earlier state instead.
+
+    :param image: The current image.
+    :param layer: The layer that's been swapped.
+    :param state_key: The swap's settings, from `swap_state_key`.
+    :param colour_map: The new colour for each colour replaced, as packed pixels with no alpha.
+    :param pixels: The layer's pixels after the swap, if already to hand. Read from the layer if not.
+    """
+    if not Gimp.Selection.is_empty(image):
+        if load_swap_state(layer) is not None:
+            layer.detach_parasite(PARASITE_NAME)
+        return
+
+    if pixels is None:
+        pixels = read_layer_pixels(layer)
+
+    state: dict = {
+        'key': state_key,
+        'width': layer.get_width(),
+        'height': layer.get_height(),
+        'colour_map': list(colour_map.items()),
+        'checksums': tile_checksums(pixels, layer.get_width(), layer.get_height()),
+    }
+    layer.attach_parasite(
+        Gimp.Parasite.new(
+            PARASITE_NAME,
+            Gimp.PARASITE_PERSISTENT | Gimp.PARASITE_UNDOABLE,
+            zlib.compress(json.dumps(state).encode())
+        )
+    )
+
+
+def palettes_to_colour_map(
+    sorted_palette_old: List[Tuple[float, float, float]],
+    sorted_palette_new: List[Tuple[float, float, float]],
+) -> Dict[int, int]:
+    """
+    Pairs up two palettes as packed pixels, as `apply_palette_map` would.
+
+    :param sorted_palette_old: The old palette, colours to be replaced.
+    :param sorted_palette_new: The new palette, colours to replace them with.
+    :return: The new colour for each colour to be replaced, as packed pixels with no alpha.
+    """
+    return {
+        rgb_to_pixel(colour_old): rgb_to_pixel(colour_new)
+        for colour_old, colour_new in zip(sorted_palette_old, sorted_palette_new)
+    }
+
+
+def reswap_changed_tiles(
+    image: Gimp.Image,
+    layer: Gimp.Layer,
+    state_key: str,
+    include_transparent: bool,
+) -> bool:
+    """
+    Re-runs the last swap on a layer, only on the tiles that have changed since.
+
+    Falls back, by returning False, if the layer hasn't been swapped with the same settings before,
+    if it's changed size, if there's a selection, or if the edits use colours that weren't part of the last swap.
+
+    :param image: The current image.
+    :param layer: The layer to re-swap.
+    :param state_key: The swap's settings, from `swap_state_key`.
+    :param include_transparent: Whether colours of transparent pixels count as edits.
+    :return: True if the layer was re-swapped, False if it needs a full swap.
+    """
+    state: Optional[dict] = load_swap_state(layer)
+    if (
+        state is None or state['key'] != state_key
+        or state['width'] != layer.get_width() or state['height'] != layer.get_height()
+        or not can_rewrite_pixels(image) or not Gimp.Selection.is_empty(image)
+    ):
+        return False
+
+    colour_map_last: Dict[int, int] = dict(state['colour_map'])
+    # Colours mapped to themselves, like a shared outline, never change, so can be left out.
+    colour_map: Dict[int, int] = {
+        colour_old: colour_new for colour_old, colour_new in colour_map_last.items() if colour_old != colour_new
+    }
+    # If the palettes otherwise overlap, there's no telling swapped pixels from edited ones.
+    if set(colour_map) & set(colour_map.values()):
+        print(f"{layer.get_name()}: old and new palettes overlap, swapping in full")
+        return False
+
+    width, height = layer.get_width(), layer.get_height()
+    pixels: array = read_layer_pixels(layer)
+    tiles: List[Tuple[int, int, int, int]] = list(iterate_tiles(width, height, STATE_TILE_SIZE))
+    tiles_changed: List[Tuple[int, int, int, int]] = [
+        tile for tile, checksum, checksum_last in zip(tiles, tile_checksums(pixels, width, height), state['checksums'])
+        if checksum != checksum_last
+    ]
+    print(f"{layer.get_name()}: {len(tiles_changed)} of {len(tiles)} tiles changed since the last swap")
+    if not tiles_changed:
+        return True
+
+    # Re-extract the colours from just the changed tiles.
+    tiles_pixels: List[array] = [get_tile(pixels, width, tile) for tile in tiles_changed]
+    colours_changed = {
+        pixel & RGB_MASK
+        for tile_pixels in tiles_pixels for pixel in set(tile_pixels)
+        if include_transparent or pixel & ALPHA_MASK
+    }
+    colours_unknown = colours_changed - set(colour_map_last) - set(colour_map_last.values())
+    if colours_unknown:
+        print(f"{layer.get_name()}: edits add {len(colours_unknown)} new colours, swapping in full")
+        return False
+
+    # Edits may only use colours the swap leaves alone, e.g. the new palette, so only write tiles that change.
+    bounds: Optional[Tuple[int, int, int, int]] = None
+    for tile, tile_pixels in zip(tiles_changed, tiles_pixels):
+        tile_mapped = array('I', [
+            colour_map[pixel & RGB_MASK] | (pixel & ALPHA_MASK) if pixel & RGB_MASK in colour_map else pixel
+            for pixel in tile_pixels
+        ])
+        if tile_mapped != tile_pixels:
+            put_tile(pixels, width, tile, tile_mapped)
+            bounds = union_bounds(bounds, tile)
+
+    # If nothing's changed, don't leave an empty step on the undo stack; just remember the edited tiles.
+    if bounds is not None:
+        write_layer_pixels(layer, pixels, bounds)
+    save_swap_state(image, layer, state_key, colour_map_last, pixels)
+    return True
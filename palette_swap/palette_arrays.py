@@ -0,0 +1,89 @@
+"""
+For the script-only meta-plugins PaletteExtract and PaletteSwapArrays
+"""
+# -*- coding: utf-8 -*-
+import sys
+from typing import List, Tuple
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+from gi.repository import Gegl
+
+from palette_swap import count_palette, sort_palette_counts, rgb_to_brightness, rgb_to_pixel, remap_layer
+from palette_swap.engine import can_rewrite_pixels
+
+
+def palette_to_arrays(
+    layer_sample: Gimp.Layer,
+    include_transparent: bool,
+    count_threshold: int,
+) -> Tuple[List[Tuple[float, float, float]], List[int], List[float]]:
+    """
+    Extracts the palette of a layer as parallel arrays, sorted from darkest to lightest.
+
+    :param layer_sample: The layer to sample colours from.
+    :param include_transparent: Whether to sample colours from transparent pixels.
+    :param count_threshold: Whether to ignore colours with < that many pixels.
+    :return: The palette RGB colours, their pixel counts, and their brightness.
+    """
+    palette_counts = count_palette(
+        layer=layer_sample,
+        include_transparent=include_transparent,
+        current_progress=0.0, progress_fraction=1.0
+    )
+    sorted_palette = sort_palette_counts(palette_counts, count_threshold)
+
+    colours: List[Tuple[float, float, float]] = [colour_rgb for colour_rgb, _ in sorted_palette]
+    counts: List[int] = [colour_count for _, colour_count in sorted_palette]
+    brightness: List[float] = [rgb_to_brightness(colour_rgb) for colour_rgb in colours]
+    return colours, counts, brightness
+
+
+def palette_to_bytes(
+    palette: List[Tuple[float, float, float]],
+) -> bytes:
+    """
+    Packs a palette into 8-bit sRGB triples, as used by Gimp.Palette and colormaps.
+
+    :param palette: The palette, as a list of RGB colours.
+    :return: The palette, as 3 bytes per colour.
+    """
+    return b''.join(
+        rgb_to_pixel(colour_rgb).to_bytes(4, sys.byteorder)[0:3] for colour_rgb in palette
+    )
+
+
+def palette_swap_arrays(
+    image: Gimp.Image,
+    layer_target: Gimp.Layer,
+    palette_old: List[Gegl.Color],
+    palette_new: List[Gegl.Color],
+):
+    """
+    Given two colour arrays, swaps the target layer's colours from the old to the new.
+
+    Intended to be called from scripts, so it doesn't open an undo group
+    or flush the displays; the caller is expected to manage those.
+    The pixels are rewritten in one go, so the swap is a single undo step,
+    and the selection and foreground colour are left alone.
+
+    :param image: The current image.
+    :param layer_target: The target layer.
+    :param palette_old: The old palette, colours to be replaced.
+    :param palette_new: The new palette, colours to replace them with.
+    :raises ValueError: If the palettes are differing lengths, or the image isn't 8-bit RGB.
+    """
+    if len(palette_old) != len(palette_new):
+        raise ValueError("Palettes are differing lengths!")
+    if not can_rewrite_pixels(image):
+        raise ValueError("Swapping arrays rewrites pixels as 8-bit RGB, so only works on 8-bit RGB images.")
+
+    remap_layer(
+        layer=layer_target,
+        colour_map={
+            rgb_to_pixel(colour_old.get_rgba()[0:3]): rgb_to_pixel(colour_new.get_rgba()[0:3])
+            for colour_old, colour_new in zip(palette_old, palette_new)
+        },
+        tile_size=0,
+    )
@@ -0,0 +1,123 @@
+"""
+For the meta-plugin PaletteGradientMap
+"""
+# -*- coding: utf-8 -*-
+from typing import Dict, List, Set
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+
+from palette_swap import (
+    ALPHA_MASK, RGB_MASK,
+    extract_linear_palette, extract_sorted_palette, rgb_to_brightness,
+    build_brightness_lut, pixel_to_rgb, open_layer_pixels, write_layer_pixels, map_pixels,
+)
+from palette_swap.engine import can_rewrite_pixels
+
+
+def palette_gradient_map(
+    image: Gimp.Image,
+    layer_target: Gimp.Layer,
+    layer_sample: Gimp.Layer,
+    include_transparent: bool,
+    count_threshold: int,
+    lut_size: int,
+    tile_size: int,
+    workers: int,
+):
+    """
+    Given a target layer, and a sample layer, remaps the brightness of the target
+    onto the palette of the sample, blending between the palette's colours.
+
+    Unlike the swap, this doesn't need the colours to match exactly,
+    so works on shaded or painted layers with many colours.
+
+    :param image: The current image.
+    :param layer_target: The target layer, to be re-coloured.
+    :param layer_sample: The layer to take the colour palette from.
+    :param include_transparent: Whether to sample and recolour transparent pixels.
+    :param count_threshold: Whether to ignore sample colours with < that many pixels.
+    :param lut_size: The number of brightness steps to blend the palette into.
+    :param tile_size: If > 0, only process each distinct tile of this size once.
+    :param workers: The number of processes to split large layers across, or 0 for one per core.
+    :raises ValueError: If the image isn't 8-bit RGB, or the target layer has no visible pixels.
+    """
+    Gimp.progress_init(
+        f"Mapping {layer_target.get_name()} onto {layer_sample.get_name()} palette..."
+    )
+
+    if not can_rewrite_pixels(image):
+        raise ValueError("Gradient maps rewrite pixels as 8-bit RGB, so only work on 8-bit RGB images.")
+
+    # Set up an undo group, so the operation will be undone in one step.
+    image.undo_group_start()
+
+    if layer_sample.get_height() == 1:
+        sorted_palette_new = extract_linear_palette(
+            layer=layer_sample,
+            current_progress=0, progress_fraction=0.4
+        )
+    else:
+        sorted_palette_new = extract_sorted_palette(
+            layer=layer_sample,
+            include_transparent=include_transparent,
+            count_threshold=count_threshold,
+            current_progress=0, progress_fraction=0.4,
+            tile_size=tile_size,
+            workers=workers,
+        )
+
+    lut: List[int] = build_brightness_lut(sorted_palette_new, lut_size)
+
+    # Large layers are read straight into shared memory, so they can be mapped across processes without copying.
+    with open_layer_pixels(layer_target, workers) as (pixels, memory_name):
+        Gimp.progress_update(0.5)
+
+        # Work out the brightness of each distinct colour once, rather than per pixel.
+        pixels_distinct: Set[int] = set(pixels)
+        colour_brightness: Dict[int, float] = {}
+        colours_visible: Set[int] = set()
+        for pixel in pixels_distinct:
+            if include_transparent or pixel & ALPHA_MASK:
+                colour_rgb = pixel & RGB_MASK
+                if colour_rgb not in colour_brightness:
+                    colour_brightness[colour_rgb] = rgb_to_brightness(pixel_to_rgb(colour_rgb))
+                if pixel & ALPHA_MASK:
+                    colours_visible.add(colour_rgb)
+
+        if not colours_visible:
+            image.undo_group_end()
+            raise ValueError(f"{layer_target.get_name()} has no visible pixels!")
+
+        # Fully transparent pixels are usually black, so would stretch the ramp; only visible ones set its ends.
+        brightness_min: float = min(colour_brightness[colour_rgb] for colour_rgb in colours_visible)
+        brightness_range: float = max(
+            colour_brightness[colour_rgb] for colour_rgb in colours_visible
+        ) - brightness_min or 1.0
+        Gimp.progress_update(0.7)
+
+        # Then build a full pixel-to-pixel map, so the layer can be remapped in a single pass.
+        colour_map: Dict[int, int] = {}
+        for pixel in pixels_distinct:
+            colour_rgb = pixel & RGB_MASK
+            if colour_rgb in colour_brightness and (include_transparent or pixel & ALPHA_MASK):
+                # Transparent colours may fall outside the visible ones' range.
+                index_lut: int = min(max(round(
+                    (colour_brightness[colour_rgb] - brightness_min) / brightness_range * (lut_size - 1)
+                ), 0), lut_size - 1)
+                if lut[index_lut] | (pixel & ALPHA_MASK) != pixel:
+                    colour_map[pixel] = lut[index_lut] | (pixel & ALPHA_MASK)
+
+        # If nothing's changed, don't leave an empty step on the undo stack.
+        if colour_map:
+            bounds = map_pixels(
+                pixels, layer_target.get_width(), layer_target.get_height(), colour_map,
+                tile_size, workers, memory_name
+            )
+            write_layer_pixels(layer_target, pixels, bounds)
+    Gimp.progress_update(1.0)
+    Gimp.displays_flush()
+
+    # Close the undo group.
+    image.undo_group_end()
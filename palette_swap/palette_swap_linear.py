@@ -7,10 +7,10 @@ from typing import List, Tuple
 import gi
 gi.require_version('Gimp', '3.0')
 from gi.repository import Gimp
-gi.require_version('GimpUi', '3.0')
-from gi.repository import Gegl
 
 from palette_swap import extract_linear_palette, apply_palette_map
+from palette_swap.engine import EnginePlan, check_can_swap, plan_engine
+from palette_swap.incremental import palettes_to_colour_map, reswap_changed_tiles, save_swap_state, swap_state_key
 
 
 def palette_swap_linear(
@@ -18,6 +18,10 @@ def palette_swap_linear(
     layer_target: Gimp.Layer,
     layer_palette_old: Gimp.Layer,
     layer_palette_new: Gimp.Layer,
+    tile_size: int,
+    workers: int,
+    engine: str,
+    incremental: bool,
 ):
     """
     Given two different 1-pixel-high 'palette' layers,
@@ -27,14 +31,17 @@ def palette_swap_linear(
     :param layer_target: The target layer.
     :param layer_palette_old: The old palette, colours to be replaced.
     :param layer_palette_new: The new palette, colours to replace them with.
-    :raises ValueError: If the palettes are differing lengths.
+    :param tile_size: If > 0, rewrite the pixels directly, only processing each distinct tile of this size once.
+    :param workers: The number of processes to split large layers across, or 0 for one per core.
+    :param engine: How to swap the palette, or 'auto' to pick the fastest. See `palette_swap.engine`.
+    :param incremental: Whether to only re-swap the parts of the layer edited since the last identical swap.
+    :raises ValueError: If the palettes are differing lengths, or the image is indexed and can't be swapped.
     """
     Gimp.progress_init(
         f"Swapping palette from {layer_palette_old.get_name()} to {layer_palette_new.get_name()} for {layer_target.get_name()}..."
     )
 
-    # Remember current foreground
-    original_foreground: Gegl.Color = Gimp.context_get_foreground()
+    check_can_swap(image)
 
     # Set up an undo group, so the operation will be undone in one step.
     image.undo_group_start()
@@ -61,17 +68,30 @@ def palette_swap_linear(
     if len(sorted_palette_new) != len(sorted_palette_old):
         raise ValueError("Palettes are differing lengths!")
 
+    state_key: str = swap_state_key('linear', sorted_palette_old, sorted_palette_new)
+    if incremental and reswap_changed_tiles(image, layer_target, state_key, True):
+        Gimp.displays_flush()
+        image.undo_group_end()
+        return
+
+    plan_swap: EnginePlan = plan_engine(
+        image, layer_target, len(sorted_palette_old), tile_size, workers, engine
+    )
     apply_palette_map(
         image=image,
         layer=layer_target,
         sorted_palette_old=sorted_palette_old,
         sorted_palette_new=sorted_palette_new,
-        current_progress=0.8, progress_fraction=0.2
+        current_progress=0.8, progress_fraction=0.2,
+        tile_size=plan_swap.tile_size,
+        workers=plan_swap.workers,
+        engine=plan_swap.engine,
     )
 
-    # Return original foreground colour
-    Gimp.context_set_foreground(original_foreground)
-    Gimp.Selection.none(image)
+    if incremental:
+        save_swap_state(
+            image, layer_target, state_key, palettes_to_colour_map(sorted_palette_old, sorted_palette_new)
+        )
 
     # Close the undo group.
     image.undo_group_end()
\ No newline at end of file
@@ -0,0 +1,120 @@
+"""
+For the script-only meta-plugin PaletteSwapRegions
+"""
+# -*- coding: utf-8 -*-
+from array import array
+from itertools import compress
+from typing import Dict, List, Optional, Set, Tuple
+
+import gi
+gi.require_version('Gimp', '3.0')
+from gi.repository import Gimp
+
+from palette_swap import (
+    CHUNK_ROWS,
+    expand_colour_map, read_palette_row, read_layer_pixels, read_mask_values, write_layer_pixels,
+)
+from palette_swap.engine import can_rewrite_pixels
+
+
+def palette_swap_regions(
+    image: Gimp.Image,
+    layer_target: Gimp.Layer,
+    masks: List[Gimp.Channel],
+    layers_palette_old: List[Gimp.Layer],
+    layers_palette_new: List[Gimp.Layer],
+):
+    """
+    Given several masks, each with a pair of 1-pixel-high 'palette' layers,
+    swaps the colours in each masked region of the current layer from its old palette to its new.
+
+    All the regions are swapped in a single pass over the layer.
+    A pixel belongs to the first region whose mask is at least half-selected there.
+
+    :param image: The current image.
+    :param layer_target: The target layer.
+    :param masks: The channel for each region, or the target layer's own mask.
+    :param layers_palette_old: The old palette for each region, colours to be replaced.
+    :param layers_palette_new: The new palette for each region, colours to replace them with.
+    :raises ValueError: If the image isn't 8-bit RGB, the number of masks and palettes differ,
+        a mask is another layer's mask, or a pair of palettes are differing lengths.
+    """
+    if not can_rewrite_pixels(image):
+        raise ValueError("Region swaps rewrite pixels as 8-bit RGB, so only work on 8-bit RGB images.")
+
+    if not len(masks) == len(layers_palette_old) == len(layers_palette_new):
+        raise ValueError("Need an old and a new palette for every mask!")
+
+    # Another layer's mask is sized and placed to match that layer, so wouldn't line up with this one.
+    mask_own: Gimp.LayerMask = layer_target.get_mask()
+    for mask in masks:
+        if isinstance(mask, Gimp.LayerMask) and (mask_own is None or mask.get_id() != mask_own.get_id()):
+            raise ValueError(
+                f"{mask.get_name()} is another layer's mask. Use a channel, or {layer_target.get_name()}'s own mask."
+            )
+
+    Gimp.progress_init(
+        f"Swapping palettes in {len(masks)} regions of {layer_target.get_name()}..."
+    )
+
+    # Build a colour map for each region.
+    progress_step: float = 0.4 / max(len(masks), 1)
+    colour_maps: List[Dict[int, int]] = []
+    for index_region, layer_palette_old, layer_palette_new in zip(
+        range(0, len(masks)), layers_palette_old, layers_palette_new
+    ):
+        palette_old: List[int] = read_palette_row(layer_palette_old)
+        palette_new: List[int] = read_palette_row(layer_palette_new)
+        if len(palette_old) != len(palette_new):
+            raise ValueError(
+                f"Palettes {layer_palette_old.get_name()} and {layer_palette_new.get_name()} are differing lengths!"
+            )
+
+        colour_maps.append(dict(zip(palette_old, palette_new)))
+        Gimp.progress_update(progress_step * (index_region + 1))
+
+    # Set up an undo group, so the operation will be undone in one step.
+    image.undo_group_start()
+
+    pixels: array = read_layer_pixels(layer_target)
+    mask_values: List[bytes] = [read_mask_values(mask, layer_target) for mask in masks]
+    Gimp.progress_update(0.5)
+
+    # Expand each region's colour map to every pixel value, so transparency is kept.
+    pixels_distinct: Set[int] = set(pixels)
+    pixel_maps: List[Dict[int, int]] = [
+        expand_colour_map(pixels_distinct, colour_map) for colour_map in colour_maps
+    ]
+    pixels_mappable: Set[int] = set().union(*pixel_maps)
+    regions: List[Tuple[Dict[int, int], bytes]] = list(zip(pixel_maps, mask_values))
+
+    # Only the pixels some region can change are looked at one by one; they're found a chunk of rows at a time.
+    index_first: Optional[int] = None
+    index_last: int = 0
+    width, height = layer_target.get_width(), layer_target.get_height()
+    for row_start in range(0, height, CHUNK_ROWS):
+        chunk_start, chunk_stop = row_start * width, min(row_start + CHUNK_ROWS, height) * width
+        for index in compress(
+            range(chunk_start, chunk_stop), map(pixels_mappable.__contains__, pixels[chunk_start:chunk_stop])
+        ):
+            for pixel_map, region_values in regions:
+                if region_values[index] >= 128:
+                    pixel = pixels[index]
+                    if pixel in pixel_map:
+                        pixels[index] = pixel_map[pixel]
+                        if index_first is None:
+                            index_first = index
+                        index_last = index
+                    break
+
+        Gimp.progress_update(0.5 + 0.4 * min(row_start + CHUNK_ROWS, height) / height)
+
+    # If nothing's changed, don't leave an empty step on the undo stack.
+    if index_first is not None:
+        row_first, row_last = index_first // width, index_last // width
+        write_layer_pixels(layer_target, pixels, (0, row_first, width, row_last - row_first + 1))
+    Gimp.progress_update(1.0)
+    Gimp.displays_flush()
+
+    # Close the undo group.
+    image.undo_group_end()
@@ -7,10 +7,10 @@ from typing import List, Tuple
 import gi
 gi.require_version('Gimp', '3.0')
 from gi.repository import Gimp
-gi.require_version('GimpUi', '3.0')
-from gi.repository import Gegl
 
 from palette_swap import extract_linear_palette, extract_sorted_palette, apply_palette_map
+from palette_swap.engine import EnginePlan, check_can_swap, plan_engine
+from palette_swap.incremental import palettes_to_colour_map, reswap_changed_tiles, save_swap_state, swap_state_key
 
 
 def palette_swap_simple(
@@ -20,6 +20,10 @@ def palette_swap_simple(
     include_transparent: bool,
     light_first: bool,
     count_threshold: int,
+    tile_size: int,
+    workers: int,
+    engine: str,
+    incremental: bool,
 ):
     """
     Given a target layer, and a sample layer, replaces the palette of the target with that of the sample.
@@ -30,15 +34,19 @@ def palette_swap_simple(
     :param include_transparent: Whether to sample colours from transparent pixels.
     :param count_threshold: Whether to ignore colours with < that many pixels.
     :param light_first: Whether to match colours lightest-to-lightest first. Defaults to darkest-to-darkest.
+    :param tile_size: If > 0, rewrite the pixels directly, only processing each distinct tile of this size once.
+    :param workers: The number of processes to split large layers across, or 0 for one per core.
+    :param engine: How to swap the palette, or 'auto' to pick the fastest. See `palette_swap.engine`.
+    :param incremental: Whether to only re-swap the parts of the layer edited since the last identical swap.
+    :raises ValueError: If the image is indexed and can't be swapped.
     """
     Gimp.progress_init(
         f"Swapping palette from {layer_sample.get_name()} onto {layer_target.get_name()}..."
     )
 
-    # Remember current foreground
-    original_foreground: Gegl.Color = Gimp.context_get_foreground()
-
     # print("Got foreground...")
+    check_can_swap(image)
+
     # Set up an undo group, so the operation will be undone in one step.
     image.undo_group_start()
     # print("Started Undo Group...")
@@ -58,23 +66,41 @@ def palette_swap_simple(
         )
     else:
         # print("Extracting sorted palette...")
+        plan_sample: EnginePlan = plan_engine(
+            image, layer_sample, 0, tile_size, workers, engine, extract_only=True
+        )
         sorted_palette_new = extract_sorted_palette(
             layer=layer_sample,
             include_transparent=include_transparent,
             count_threshold=count_threshold,
-            current_progress=0, progress_fraction=0.4
+            current_progress=0, progress_fraction=0.4,
+            tile_size=plan_sample.tile_size,
+            workers=plan_sample.workers,
         )
     # print("Found palette new...")
 
+    state_key: str = swap_state_key(
+        'simple', sorted_palette_new, include_transparent, count_threshold, light_first
+    )
+    if incremental and reswap_changed_tiles(image, layer_target, state_key, include_transparent):
+        Gimp.displays_flush()
+        image.undo_group_end()
+        return
+
     Gimp.progress_init(
         f"Finding {layer_target.get_name()} palette..."
     )
 
+    plan_target: EnginePlan = plan_engine(
+        image, layer_target, 0, tile_size, workers, engine, extract_only=True
+    )
     sorted_palette_old: List[Tuple[float, float, float]] = extract_sorted_palette(
         layer=layer_target,
         include_transparent=include_transparent,
         count_threshold=count_threshold,
-        current_progress=0.4, progress_fraction=0.4
+        current_progress=0.4, progress_fraction=0.4,
+        tile_size=plan_target.tile_size,
+        workers=plan_target.workers,
     )
     # print("Found palette old...")
 
@@ -82,17 +108,24 @@ def palette_swap_simple(
         sorted_palette_old.reverse()
         sorted_palette_new.reverse()
 
+    plan_swap: EnginePlan = plan_engine(
+        image, layer_target, min(len(sorted_palette_old), len(sorted_palette_new)), tile_size, workers, engine
+    )
     apply_palette_map(
         image=image,
         layer=layer_target,
         sorted_palette_old=sorted_palette_old,
         sorted_palette_new=sorted_palette_new,
-        current_progress=0.8, progress_fraction=0.2
+        current_progress=0.8, progress_fraction=0.2,
+        tile_size=plan_swap.tile_size,
+        workers=plan_swap.workers,
+        engine=plan_swap.engine,
     )
 
-    # Return original foreground colour
-    Gimp.context_set_foreground(original_foreground)
-    Gimp.Selection.none(image)
+    if incremental:
+        save_swap_state(
+            image, layer_target, state_key, palettes_to_colour_map(sorted_palette_old, sorted_palette_new)
+        )
 
     # Close the undo group.
     image.undo_group_end()
@@ -9,6 +9,7 @@ gi.require_version('GimpUi', '3.0')
 from gi.repository import Gegl
 
 from palette_swap import extract_sorted_palette
+from palette_swap.engine import EnginePlan, plan_engine
 
 
 def palette_to_layer(
@@ -17,6 +18,9 @@ def palette_to_layer(
     layer_name: str,
     include_transparent: bool,
     count_threshold: int,
+    tile_size: int,
+    workers: int,
+    engine: str,
 ):
     """
     Creates a 1-pixel-high 'palette' layer from the current image's selected layer.
@@ -26,6 +30,9 @@ def palette_to_layer(
     :param layer_name: The name of the new layer.
     :param include_transparent: Whether to sample colours from transparent pixels.
     :param count_threshold: Whether to ignore colours with < that many pixels.
+    :param tile_size: If > 0, only count each distinct tile of this size once.
+    :param workers: The number of processes to split large layers across, or 0 for one per core.
+    :param engine: How to read the layer, or 'auto' to pick the fastest. See `palette_swap.engine`.
     :raises ValueError: If the palettes are differing lengths.
     """
     # Set up an undo group, so the operation will be undone in one step.
@@ -36,11 +43,16 @@ def palette_to_layer(
         f"Finding {layer_sample.get_name()} palette..."
     )
 
+    plan_sample: EnginePlan = plan_engine(
+        image, layer_sample, 0, tile_size, workers, engine, extract_only=True
+    )
     sorted_palette: Gimp.Layer = extract_sorted_palette(
         layer=layer_sample,
         include_transparent=include_transparent,
         count_threshold=count_threshold,
-        current_progress=0.0, progress_fraction=1.0
+        current_progress=0.0, progress_fraction=1.0,
+        tile_size=plan_sample.tile_size,
+        workers=plan_sample.workers,
     )
     sorted_palette.reverse()
     # print(f"Extracted palette: {sorted_palette}")
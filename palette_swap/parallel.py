@@ -0,0 +1,233 @@
+"""
+Splits the pixel counting and mapping of large layers across a pool of processes.
+
+The layer's pixels are held once in shared memory, and each process works on
+a strip of rows in place, so pixels aren't copied back and forth between processes.
+Callers that read layers straight into shared memory, with `shared_pixels`, avoid copying them in at all.
+"""
+# -*- coding: utf-8 -*-
+import os
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import reduce
+from multiprocessing import get_context, shared_memory
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from palette_swap.pixels import count_pixels, map_pixels, union_bounds
+
+# Layers with fewer pixels than this aren't worth starting up processes for.
+PARALLEL_MIN_PIXELS: int = 2048 * 2048
+
+
+def get_worker_count(
+    workers: int,
+    pixel_count: int,
+) -> int:
+    """
+    Works out how many processes to use for a layer.
+
+    :param workers: The number of processes requested, or 0 for one per core.
+    :param pixel_count: The number of pixels in the layer.
+    :return: The number of processes to use; 1 if the layer is too small to be worth splitting.
+    """
+    if pixel_count < PARALLEL_MIN_PIXELS:
+        return 1
+    if workers <= 0:
+        workers = os.cpu_count() or 1
+    return workers
+
+
+def split_strips(
+    height: int,
+    workers: int,
+    tile_size: int,
+) -> List[Tuple[int, int]]:
+    """
+    Splits a layer into strips of whole rows, one per process.
+
+    :param height: The height of the layer.
+    :param workers: The number of processes.
+    :param tile_size: If > 0, strips are whole numbers of tiles high, so tiles aren't split.
+    :return: The first row, and the row after the last, of each strip.
+    """
+    strip_height: int = -(-height // workers)
+    if tile_size > 0:
+        strip_height = -(-strip_height // tile_size) * tile_size
+    return [
+        (row_start, min(row_start + strip_height, height)) for row_start in range(0, height, strip_height)
+    ]
+
+
+@contextmanager
+def shared_pixels(
+    pixel_count: int,
+) -> Iterator[Tuple[str, memoryview]]:
+    """
+    Sets aside shared memory for a layer's pixels, for the length of a `with` block.
+
+    The view must not be kept, or sliced and kept, past the end of the block.
+
+    :param pixel_count: The number of pixels in the layer.
+    :return: The name of the shared memory, to pass to `run_strips`, and a view of it as packed pixels.
+    """
+    memory_size: int = pixel_count * array('I').itemsize
+    memory = shared_memory.SharedMemory(create=True, size=memory_size)
+    try:
+        # The shared memory may be rounded up to a whole number of pages, so only use the start.
+        with memory.buf[:memory_size] as pixels_bytes, pixels_bytes.cast('I') as pixels_shared:
+            yield memory.name, pixels_shared
+    finally:
+        memory.close()
+        memory.unlink()
+
+
+def count_strip(
+    memory_name: str,
+    width: int,
+    row_start: int,
+    row_stop: int,
+    tile_size: int,
+) -> Counter:
+    """
+    Counts how many times each pixel value appears in a strip of the shared pixels.
+
+    :param memory_name: The name of the shared memory holding the layer's pixels.
+    :param width: The width of the layer.
+    :param row_start: The first row of the strip.
+    :param row_stop: The row after the last row of the strip.
+    :param tile_size: If > 0, only count each distinct tile of this size once.
+    :return: The count of each pixel value in the strip.
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        with memory.buf.cast('I') as pixels_shared, pixels_shared[row_start * width:row_stop * width] as pixels:
+            return count_pixels(pixels, width, row_stop - row_start, tile_size)
+    finally:
+        memory.close()
+
+
+def map_strip(
+    memory_name: str,
+    width: int,
+    row_start: int,
+    row_stop: int,
+    tile_size: int,
+    pixel_map: Dict[int, int],
+) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Replaces pixel values in a strip of the shared pixels, in place.
+
+    :param memory_name: The name of the shared memory holding the layer's pixels.
+    :param width: The width of the layer.
+    :param row_start: The first row of the strip.
+    :param row_stop: The row after the last row of the strip.
+    :param tile_size: If > 0, only map each distinct tile of this size once, and copy it to the repeats.
+    :param pixel_map: The new value for each pixel value to be replaced.
+    :return: The x, y, width and height of the area of the layer that's changed, or None if nothing has.
+    """
+    memory = shared_memory.SharedMemory(name=memory_name)
+    try:
+        with memory.buf.cast('I') as pixels_shared, pixels_shared[row_start * width:row_stop * width] as pixels:
+            bounds = map_pixels(pixels, width, row_stop - row_start, pixel_map, tile_size)
+    finally:
+        memory.close()
+
+    if bounds is None:
+        return None
+    return bounds[0], bounds[1] + row_start, bounds[2], bounds[3]
+
+
+def run_strips(
+    function: Callable,
+    memory_name: str,
+    width: int,
+    height: int,
+    tile_size: int,
+    workers: int,
+    *arguments,
+) -> list:
+    """
+    Runs a function over each strip of a layer's pixels in shared memory, in a process pool.
+
+    :param function: The function to run on each strip, e.g. `count_strip`.
+    :param memory_name: The name of the shared memory holding the layer's pixels, from `shared_pixels`.
+    :param width: The width of the layer.
+    :param height: The height of the layer.
+    :param tile_size: The tile size, passed on to the function.
+    :param workers: The number of processes.
+    :param arguments: Any more arguments to pass to the function.
+    :return: The result for each strip.
+    """
+    # Forking a GIMP plug-in would copy its connection to GIMP, so always start fresh processes.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as executor:
+        futures = [
+            executor.submit(function, memory_name, width, row_start, row_stop, tile_size, *arguments)
+            for row_start, row_stop in split_strips(height, workers, tile_size)
+        ]
+        return [future.result() for future in futures]
+
+
+def count_pixels_parallel(
+    pixels: array,
+    width: int,
+    height: int,
+    tile_size: int,
+    workers: int,
+    memory_name: Optional[str] = None,
+) -> Counter:
+    """
+    Counts how many times each pixel value appears, split across processes.
+
+    :param pixels: The layer's pixels, as from `read_layer_pixels`.
+    :param width: The width of the layer.
+    :param height: The height of the layer.
+    :param tile_size: If > 0, only count each distinct tile of this size once per strip.
+    :param workers: The number of processes.
+    :param memory_name: The name of the shared memory the pixels are already in. If None, they're copied in.
+    :return: The count of each pixel value.
+    """
+    if memory_name is None:
+        with shared_pixels(len(pixels)) as (memory_name, pixels_shared):
+            pixels_shared[:] = pixels
+            return count_pixels_parallel(pixels_shared, width, height, tile_size, workers, memory_name)
+
+    pixel_counts: Counter = Counter()
+    for strip_count in run_strips(count_strip, memory_name, width, height, tile_size, workers):
+        pixel_counts.update(strip_count)
+    return pixel_counts
+
+
+def map_pixels_parallel(
+    pixels: array,
+    width: int,
+    height: int,
+    pixel_map: Dict[int, int],
+    tile_size: int,
+    workers: int,
+    memory_name: Optional[str] = None,
+) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Replaces pixel values using a map, in place, split across processes.
+
+    :param pixels: The layer's pixels, as from `read_layer_pixels`.
+    :param width: The width of the layer.
+    :param height: The height of the layer.
+    :param pixel_map: The new value for each pixel value to be replaced.
+    :param tile_size: If > 0, only map each distinct tile of this size once per strip.
+    :param workers: The number of processes.
+    :param memory_name: The name of the shared memory the pixels are already in. If None, they're copied in and back.
+    :return: The x, y, width and height of the area that's changed, or None if nothing has.
+    """
+    if memory_name is None:
+        with shared_pixels(len(pixels)) as (memory_name, pixels_shared), memoryview(pixels) as pixels_view:
+            pixels_shared[:] = pixels_view
+            bounds = map_pixels_parallel(pixels_shared, width, height, pixel_map, tile_size, workers, memory_name)
+            pixels_view[:] = pixels_shared
+        return bounds
+
+    strip_bounds: List[Optional[Tuple[int, int, int, int]]] = run_strips(
+        map_strip, memory_name, width, height, tile_size, workers, pixel_map
+    )
+    return reduce(union_bounds, strip_bounds, None)
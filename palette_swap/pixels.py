@@ -0,0 +1,233 @@
+"""
+The pixel helpers shared by all palette swap procedures, that work on packed pixels alone.
+
+These only need the standard library, so worker processes and tests can use them without GIMP.
+"""
+# -*- coding: utf-8 -*-
+import sys
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Pixels are packed into one unsigned int each, as 8-bit R'G'B'A bytes in native order.
+ALPHA_MASK: int = int.from_bytes(b'\x00\x00\x00\xff', sys.byteorder)
+RGB_MASK: int = int.from_bytes(b'\xff\xff\xff\x00', sys.byteorder)
+# Layers are read, written and mapped this many rows at a time, so there's never a second full copy of the pixels.
+CHUNK_ROWS: int = 256
+
+
+def iterate_tiles(
+    width: int,
+    height: int,
+    tile_size: int,
+) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Steps over an area in square tiles, row by row. Tiles on the right and bottom edges may be smaller.
+
+    :param width: The width of the area.
+    :param height: The height of the area.
+    :param tile_size: The width and height of each tile.
+    :return: The x, y, width and height of each tile.
+    """
+    for tile_y in range(0, height, tile_size):
+        for tile_x in range(0, width, tile_size):
+            yield tile_x, tile_y, min(tile_size, width - tile_x), min(tile_size, height - tile_y)
+
+
+def get_tile(
+    pixels: array,
+    width: int,
+    tile: Tuple[int, int, int, int],
+) -> array:
+    """
+    Copies the pixels within a tile out of a layer's pixels.
+
+    :param pixels: The layer's pixels, as from `read_layer_pixels`.
+    :param width: The width of the layer.
+    :param tile: The x, y, width and height of the tile.
+    :return: The tile's pixels, row by row.
+    """
+    tile_x, tile_y, tile_width, tile_height = tile
+    tile_pixels = array('I')
+    for row in range(tile_y, tile_y + tile_height):
+        tile_pixels.extend(pixels[row * width + tile_x:row * width + tile_x + tile_width])
+    return tile_pixels
+
+
+def put_tile(
+    pixels: array,
+    width: int,
+    tile: Tuple[int, int, int, int],
+    tile_pixels: array,
+):
+    """
+    Copies a tile's pixels back into a layer's pixels, in place.
+
+    :param pixels: The layer's pixels, as from `read_layer_pixels`.
+    :param width: The width of the layer.
+    :param tile: The x, y, width and height of the tile.
+    :param tile_pixels: The tile's pixels, row by row.
+    """
+    tile_x, tile_y, tile_width, tile_height = tile
+    for row in range(0, tile_height):
+        row_start: int = (tile_y + row) * width + tile_x
+        pixels[row_start:row_start + tile_width] = tile_pixels[row * tile_width:(row + 1) * tile_width]
+
+
+def deduplicate_tiles(
+    pixels: array,
+    width: int,
+    height: int,
+    tile_size: int,
+) -> Dict[Tuple[int, int, bytes], List[Tuple[int, int, int, int]]]:
+    """
+    Groups the tiles of a layer by their content, so repeated tiles can be processed once.
+
+    :param pixels: The layer's pixels, as from `read_layer_pixels`.
+    :param width: The width of the layer.
+    :param height: The height of the layer.
+    :param tile_size: The width and height of each tile.
+    :return: For each distinct tile's shape and content, every tile that has it.
+    """
+    tiles: defaultdict = defaultdict(list)
+    for tile in iterate_tiles(width, height, tile_size):
+        # Edge tiles have different shapes, so include that in the key.
+        tiles[(tile[2], tile[3], get_tile(pixels, width, tile).tobytes())].append(tile)
+    return tiles
+
+
+def count_pixels(
+    pixels: array,
+    width: int,
+    height: int,
+    tile_size: int,
+    workers: int = 1,
+    memory_name: Optional[str] = None,
+) -> Counter:
+    """
+    Counts how many times each pixel value appears.
+
+    :param pixels: The layer's pixels, as from `read_layer_pixels`, or a view of them.
+    :param width: The width of the layer.
+    :param height: The height of the layer.
+    :param tile_size: If > 0, only count each distinct tile of this size once.
+    :param workers: The number of processes to split large layers across, or 0 for one per core.
+    :param memory_name: The name of the shared memory the pixels are already in, if they are, so they aren't copied.
+    :return: The count of each pixel value.
+    """
+    if workers != 1:
+        from palette_swap import parallel
+        worker_count: int = parallel.get_worker_count(workers, len(pixels))
+        if worker_count > 1:
+            return parallel.count_pixels_parallel(pixels, width, height, tile_size, worker_count, memory_name)
+
+    if tile_size <= 0:
+        return Counter(pixels)
+
+    pixel_counts: Counter = Counter()
+    for tiles in deduplicate_tiles(pixels, width, height, tile_size).values():
+        for pixel, pixel_count in Counter(get_tile(pixels, width, tiles[0])).items():
+            pixel_counts[pixel] += pixel_count * len(tiles)
+    return pixel_counts
+
+
+def map_pixels(
+    pixels: array,
+    width: int,
+    height: int,
+    pixel_map: Dict[int, int],
+    tile_size: int,
+    workers: int = 1,
+    memory_name: Optional[str] = None,
+) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Replaces pixel values using a map, in place, leaving any not in it unchanged.
+
+    :param pixels: The layer's pixels, as from `read_layer_pixels`, or a view of them.
+    :param width: The width of the layer.
+    :param height: The height of the layer.
+    :param pixel_map: The new value for each pixel value to be replaced.
+    :param tile_size: If > 0, only map each distinct tile of this size once, and copy it to the repeats.
+    :param workers: The number of processes to split large layers across, or 0 for one per core.
+    :param memory_name: The name of the shared memory the pixels are already in, if they are, so they aren't copied.
+    :return: The x, y, width and height of the area that's changed, or None if nothing has.
+    """
+    if workers != 1:
+        from palette_swap import parallel
+        worker_count: int = parallel.get_worker_count(workers, len(pixels))
+        if worker_count > 1:
+            return parallel.map_pixels_parallel(
+                pixels, width, height, pixel_map, tile_size, worker_count, memory_name
+            )
+
+    bounds: Optional[Tuple[int, int, int, int]] = None
+    if tile_size <= 0:
+        for row_start in range(0, height, CHUNK_ROWS):
+            row_stop: int = min(row_start + CHUNK_ROWS, height)
+            chunk_pixels = pixels[row_start * width:row_stop * width]
+            chunk_mapped = array('I', map(pixel_map.get, chunk_pixels, chunk_pixels))
+            if chunk_mapped == chunk_pixels:
+                continue
+
+            # Narrow the changed area down to the rows that differ, before the chunk is overwritten.
+            rows_changed: List[int] = [
+                row for row in range(0, row_stop - row_start)
+                if chunk_mapped[row * width:(row + 1) * width] != chunk_pixels[row * width:(row + 1) * width]
+            ]
+            bounds = union_bounds(
+                bounds, (0, row_start + rows_changed[0], width, rows_changed[-1] - rows_changed[0] + 1)
+            )
+            pixels[row_start * width:row_stop * width] = chunk_mapped
+        return bounds
+
+    # Tiles with the same content are always mapped the same, so can be overwritten as they go.
+    for tiles in deduplicate_tiles(pixels, width, height, tile_size).values():
+        tile_pixels: array = get_tile(pixels, width, tiles[0])
+        tile_mapped = array('I', map(pixel_map.get, tile_pixels, tile_pixels))
+        if tile_mapped == tile_pixels:
+            continue
+
+        for tile in tiles:
+            put_tile(pixels, width, tile, tile_mapped)
+            bounds = union_bounds(bounds, tile)
+    return bounds
+
+
+def union_bounds(
+    bounds: Optional[Tuple[int, int, int, int]],
+    bounds_other: Optional[Tuple[int, int, int, int]],
+) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Finds the smallest area covering two others.
+
+    :param bounds: The x, y, width and height of an area, or None for no area.
+    :param bounds_other: The x, y, width and height of another area, or None for no area.
+    :return: The x, y, width and height of the area covering both, or None if neither is an area.
+    """
+    if bounds is None:
+        return bounds_other
+    if bounds_other is None:
+        return bounds
+
+    x_start, y_start = min(bounds[0], bounds_other[0]), min(bounds[1], bounds_other[1])
+    x_stop = max(bounds[0] + bounds[2], bounds_other[0] + bounds_other[2])
+    y_stop = max(bounds[1] + bounds[3], bounds_other[1] + bounds_other[3])
+    return x_start, y_start, x_stop - x_start, y_stop - y_start
+
+
+def expand_colour_map(
+    pixels: Iterable[int],
+    colour_map: Dict[int, int],
+) -> Dict[int, int]:
+    """
+    Expands a colour map to every pixel value in a layer, keeping each pixel's transparency.
+
+    :param pixels: The layer's pixels, as from `read_layer_pixels`, a view of them, or their distinct values.
+    :param colour_map: The new colour for each colour to be replaced, as packed pixels with no alpha.
+    :return: The new value for each pixel value that changes. Empty if none do.
+    """
+    pixel_map: Dict[int, int] = {
+        pixel: colour_map[pixel & RGB_MASK] | (pixel & ALPHA_MASK)
+        for pixel in set(pixels) if pixel & RGB_MASK in colour_map
+    }
+    return {pixel: pixel_new for pixel, pixel_new in pixel_map.items() if pixel_new != pixel}
@@ -0,0 +1,56 @@
+"""
+The layer shared by the pixel tests.
+
+Also lets the tests import the standard-library-only parts of `palette_swap` where GIMP's Python bindings
+aren't installed. The package's `__init__` needs GIMP, but `palette_swap.pixels` and `palette_swap.parallel`
+don't, so without GIMP the package is registered bare, without running its `__init__`.
+"""
+# -*- coding: utf-8 -*-
+import os
+import random
+import sys
+import types
+from array import array
+from typing import Dict, List
+
+import pytest
+
+PACKAGE_PATH: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'palette_swap')
+
+try:
+    import palette_swap
+except (ImportError, ValueError):
+    # `gi.require_version` raises ValueError if gi is installed, but GIMP's typelibs aren't.
+    palette_swap = types.ModuleType('palette_swap')
+    palette_swap.__path__ = [PACKAGE_PATH]
+    sys.modules['palette_swap'] = palette_swap
+
+# Without GIMP's bindings, processes spawned to work on strips can't import the package,
+# and the GIMP-side helpers aren't there.
+requires_gimp = pytest.mark.skipif(
+    not hasattr(palette_swap, 'PIXEL_FORMAT'), reason="GIMP 3's Python bindings aren't installed"
+)
+
+WIDTH: int = 100
+HEIGHT: int = 70
+TILE_SIZE: int = 10
+
+
+@pytest.fixture
+def pixels() -> array:
+    """
+    A layer made of four distinct tiles, repeated, with edge tiles cut short.
+    """
+    generator = random.Random(1)
+    tiles: List[List[int]] = [
+        [generator.randrange(0, 6) for _ in range(0, TILE_SIZE * TILE_SIZE)] for _ in range(0, 4)
+    ]
+    return array('I', [
+        tiles[(y // TILE_SIZE + x // TILE_SIZE) % 4][(y % TILE_SIZE) * TILE_SIZE + x % TILE_SIZE]
+        for y in range(0, HEIGHT) for x in range(0, WIDTH)
+    ])
+
+
+@pytest.fixture
+def pixel_map() -> Dict[int, int]:
+    return {0: 9, 1: 8, 2: 2}
@@ -0,0 +1,60 @@
+"""
+Tests for the batch runner's job handling, which only needs the standard library.
+"""
+# -*- coding: utf-8 -*-
+import argparse
+import importlib.util
+import json
+import os
+
+import pytest
+
+SCRIPT_PATH: str = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'ttt-palette-swap-batch.py')
+spec = importlib.util.spec_from_file_location('ttt_palette_swap_batch', SCRIPT_PATH)
+batch = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(batch)
+
+
+def make_arguments(**kwargs) -> argparse.Namespace:
+    """
+    Builds arguments as the command line would, with the defaults overridden.
+    """
+    arguments = {
+        'files': [], 'jobs': None, 'procedure': 'ttt-palette-swap-simple', 'option': [],
+        'output_dir': None, 'suffix': '-swapped',
+    }
+    arguments.update(kwargs)
+    return argparse.Namespace(**arguments)
+
+
+def test_read_jobs_from_files(tmp_path):
+    jobs = batch.read_jobs(make_arguments(
+        files=[str(tmp_path / 'knight.xcf')],
+        option=['layer-sample=Orange', 'count-threshold=2', 'light-first=true'],
+    ))
+    assert jobs == [{
+        'file': str(tmp_path / 'knight.xcf'),
+        'output': str(tmp_path / 'knight-swapped.xcf'),
+        'procedure': 'ttt-palette-swap-simple',
+        # Options are parsed as JSON where they can be, and left as strings where not.
+        'options': {'layer-sample': 'Orange', 'count-threshold': 2, 'light-first': True},
+        'defaults': {'workers': 1},
+    }]
+
+
+def test_read_jobs_from_jobs_file(tmp_path):
+    jobs_path = tmp_path / 'jobs.jsonl'
+    jobs_path.write_text(
+        json.dumps({'file': 'a.xcf', 'procedure': 'ttt-palette-swap-linear', 'options': {'workers': 4}}) + '\n\n'
+        + json.dumps({'file': 'b.xcf', 'procedure': 'ttt-palette-swap-simple', 'output': 'c.xcf'}) + '\n'
+    )
+    jobs = batch.read_jobs(make_arguments(jobs=str(jobs_path), output_dir=str(tmp_path / 'out')))
+
+    assert [job['output'] for job in jobs] == [str(tmp_path / 'out' / 'a-swapped.xcf'), os.path.abspath('c.xcf')]
+    # Jobs can still ask for more workers; the default only applies where they don't.
+    assert jobs[0]['options'] == {'workers': 4} and jobs[0]['defaults'] == {'workers': 1}
+
+
+def test_read_jobs_needs_procedure():
+    with pytest.raises(ValueError):
+        batch.read_jobs(make_arguments(files=['a.xcf'], procedure=None))
@@ -0,0 +1,23 @@
+"""
+Tests for the gradient map's lookup table, that don't need a running GIMP, only its Python bindings.
+"""
+# -*- coding: utf-8 -*-
+import pytest
+
+gi = pytest.importorskip('gi')
+try:
+    gi.require_version('Gimp', '3.0')
+except ValueError:
+    pytest.skip("GIMP 3's Python bindings aren't installed", allow_module_level=True)
+
+from palette_swap import build_brightness_lut, rgb_to_pixel
+
+
+def test_build_brightness_lut():
+    palette = [(0.0, 0.0, 0.0), (1.0, 1.0, 1.0)]
+    lut = build_brightness_lut(palette, 5)
+    assert len(lut) == 5
+    assert lut[0] == rgb_to_pixel(palette[0]) and lut[-1] == rgb_to_pixel(palette[-1])
+    assert build_brightness_lut(palette[0:1], 3) == [rgb_to_pixel(palette[0])] * 3
+    with pytest.raises(ValueError):
+        build_brightness_lut([], 3)
@@ -0,0 +1,88 @@
+"""
+Tests for splitting counting and mapping across processes.
+
+The helpers only need the standard library, but the tests that start processes
+need GIMP's Python bindings, as the processes import the whole package.
+"""
+# -*- coding: utf-8 -*-
+import sys
+from array import array
+from collections import Counter
+
+import pytest
+
+from palette_swap import parallel
+from palette_swap.pixels import ALPHA_MASK, count_pixels, expand_colour_map, map_pixels
+
+from conftest import HEIGHT, TILE_SIZE, WIDTH, requires_gimp
+
+
+@pytest.fixture
+def parallel_always(monkeypatch):
+    """
+    Splits even the small test layer across processes.
+    """
+    monkeypatch.setattr(parallel, 'PARALLEL_MIN_PIXELS', 1)
+
+
+@requires_gimp
+@pytest.mark.parametrize('tile_size', [0, TILE_SIZE])
+def test_count_pixels_parallel(pixels, tile_size, parallel_always):
+    assert count_pixels(pixels, WIDTH, HEIGHT, tile_size, workers=3) == Counter(pixels)
+
+
+@requires_gimp
+@pytest.mark.parametrize('tile_size', [0, TILE_SIZE])
+def test_map_pixels_parallel(pixels, pixel_map, tile_size, parallel_always):
+    pixels_expected = array('I', [pixel_map.get(pixel, pixel) for pixel in pixels])
+    bounds_expected = map_pixels(array('I', pixels), WIDTH, HEIGHT, pixel_map, tile_size)
+    assert map_pixels(pixels, WIDTH, HEIGHT, pixel_map, tile_size, workers=3) == bounds_expected
+    assert pixels == pixels_expected
+
+
+@requires_gimp
+def test_map_strips_in_shared_memory(pixels, pixel_map):
+    pixels_expected = array('I', [pixel_map.get(pixel, pixel) for pixel in pixels])
+    with parallel.shared_pixels(len(pixels)) as (memory_name, pixels_shared):
+        pixels_shared[:] = pixels
+        parallel.run_strips(parallel.map_strip, memory_name, WIDTH, HEIGHT, 0, 3, pixel_map)
+        assert array('I', pixels_shared) == pixels_expected
+
+
+@requires_gimp
+def test_pixels_already_in_shared_memory(pixels, pixel_map, parallel_always):
+    pixels_expected = array('I', [pixel_map.get(pixel, pixel) for pixel in pixels])
+    with parallel.shared_pixels(len(pixels)) as (memory_name, pixels_shared):
+        pixels_shared[:] = pixels
+        # The processes work on the shared memory in place, rather than on a copy.
+        assert count_pixels(pixels_shared, WIDTH, HEIGHT, 0, 3, memory_name) == Counter(pixels)
+        map_pixels(pixels_shared, WIDTH, HEIGHT, pixel_map, 0, 3, memory_name)
+        assert array('I', pixels_shared) == pixels_expected
+
+
+@pytest.mark.parametrize('height, workers, tile_size', [(70, 3, 0), (70, 3, 16), (5, 8, 0), (1, 1, 0)])
+def test_split_strips(height, workers, tile_size):
+    strips = parallel.split_strips(height, workers, tile_size)
+    assert strips[0][0] == 0 and strips[-1][1] == height
+    assert all(strip[1] == strip_next[0] for strip, strip_next in zip(strips, strips[1:]))
+    assert len(strips) <= workers
+    if tile_size:
+        assert all(row_start % tile_size == 0 for row_start, _ in strips)
+
+
+def pack(red: int, green: int, blue: int, alpha: int) -> int:
+    """
+    Packs a pixel as `read_layer_pixels` does.
+    """
+    return int.from_bytes(bytes([red, green, blue, alpha]), sys.byteorder)
+
+
+def test_expand_colour_map():
+    colour_old, colour_new, colour_same = pack(1, 2, 3, 0), pack(4, 5, 6, 0), pack(7, 8, 9, 0)
+    pixels = array('I', [colour_old | pack(0, 0, 0, 128), colour_old | ALPHA_MASK, colour_same | ALPHA_MASK])
+
+    # Each pixel keeps its own alpha, and colours that don't change are left out.
+    assert expand_colour_map(pixels, {colour_old: colour_new, colour_same: colour_same}) == {
+        colour_old | pack(0, 0, 0, 128): colour_new | pack(0, 0, 0, 128),
+        colour_old | ALPHA_MASK: colour_new | ALPHA_MASK,
+    }
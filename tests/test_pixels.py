@@ -0,0 +1,47 @@
+"""
+Tests for the tile, counting and mapping helpers, that only need the standard library.
+"""
+# -*- coding: utf-8 -*-
+from array import array
+from collections import Counter
+
+import pytest
+
+from palette_swap.pixels import count_pixels, deduplicate_tiles, iterate_tiles, map_pixels
+
+from conftest import HEIGHT, TILE_SIZE, WIDTH
+
+
+@pytest.mark.parametrize('tile_size', [0, TILE_SIZE, 16])
+def test_count_pixels(pixels, tile_size):
+    assert count_pixels(pixels, WIDTH, HEIGHT, tile_size) == Counter(pixels)
+
+
+@pytest.mark.parametrize('tile_size', [0, TILE_SIZE, 16])
+def test_map_pixels(pixels, pixel_map, tile_size):
+    pixels_expected = array('I', [pixel_map.get(pixel, pixel) for pixel in pixels])
+    map_pixels(pixels, WIDTH, HEIGHT, pixel_map, tile_size)
+    assert pixels == pixels_expected
+
+
+def test_deduplicate_tiles(pixels):
+    tiles: dict = deduplicate_tiles(pixels, WIDTH, HEIGHT, TILE_SIZE)
+    # Four distinct full tiles; the bottom row is full height as 70 is a multiple of 10.
+    assert len(tiles) == 4
+    assert sorted(tile for tiles_same in tiles.values() for tile in tiles_same) == sorted(
+        iterate_tiles(WIDTH, HEIGHT, TILE_SIZE)
+    )
+
+    # Edge tiles are a different shape, so are never grouped with full ones.
+    for (tile_width, tile_height, _), tiles_same in deduplicate_tiles(pixels, WIDTH, HEIGHT, 16).items():
+        assert all(tile[2:] == (tile_width, tile_height) for tile in tiles_same)
+
+
+@pytest.mark.parametrize('tile_size, bounds_expected', [(0, (0, 30, WIDTH, 11)), (TILE_SIZE, (0, 30, 30, 20))])
+def test_map_pixels_bounds(tile_size, bounds_expected):
+    pixels = array('I', [0]) * (WIDTH * HEIGHT)
+    pixels[30 * WIDTH + 7] = pixels[40 * WIDTH + 20] = 1
+
+    # Only the changed rows, or tiles, need redrawing; mapping again changes nothing.
+    assert map_pixels(pixels, WIDTH, HEIGHT, {1: 2}, tile_size) == bounds_expected
+    assert map_pixels(pixels, WIDTH, HEIGHT, {1: 2}, tile_size) is None
@@ -0,0 +1,348 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Runs the palette swap procedures over many files, using a pool of long-lived
+`gimp-console` workers so GIMP only starts up once per worker. GIMP still starts
+a fresh plug-in process for each file, as it does for every procedure call.
+
+Jobs are given either as a JSON-lines file, one job per line:
+
+    {"file": "knight.xcf", "procedure": "ttt-palette-swap-simple", "options": {"layer-sample": "Orange"}}
+
+or as a list of files sharing the same procedure and options:
+
+    ttt-palette-swap-batch.py --procedure ttt-palette-swap-simple --option layer-sample=Orange *.xcf
+
+Each job may also give the `layer` to recolour, and the `output` to save to.
+This script doesn't need GIMP's Python; any Python 3 will do.
+"""
+import argparse
+import json
+import os
+import queue
+import secrets
+import select
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Connection, answer_challenge, deliver_challenge
+from typing import Dict, List, Optional, Set, Tuple
+
+PLUGIN_DIR: str = os.path.dirname(os.path.abspath(__file__))
+GIMP_CONSOLE_NAMES: List[str] = ['gimp-console-3.0', 'gimp-console-3', 'gimp-console']
+AUTHKEY_VARIABLE: str = 'TTT_PALETTE_SWAP_BATCH_KEY'
+# How long to wait for GIMP to start up and connect back, and how often to check on it meanwhile.
+CONNECT_TIMEOUT_SECONDS: float = 120.0
+POLL_SECONDS: float = 0.5
+# Each GIMP worker already has a core to itself, so don't let it split layers across every core as well.
+DEFAULT_OPTIONS: Dict[str, object] = {'workers': 1}
+
+WORKER_CODE: str = (
+    "import os, sys; "
+    "sys.path.insert(0, {plugin_dir!r}); "
+    "import palette_swap.batch; "
+    "palette_swap.batch.serve(('localhost', {port}), bytes.fromhex(os.environ[{variable!r}]), {worker_index})"
+)
+
+
+def find_gimp_console() -> Optional[str]:
+    """
+    Finds the GIMP console executable on the path.
+
+    :return: The path to the executable, or None if there isn't one.
+    """
+    for name in GIMP_CONSOLE_NAMES:
+        path = shutil.which(name)
+        if path:
+            return path
+    return None
+
+
+def read_jobs(
+    arguments: argparse.Namespace,
+) -> List[Dict[str, object]]:
+    """
+    Builds the list of jobs from the command-line arguments.
+
+    :param arguments: The parsed command-line arguments.
+    :return: The jobs, each with `file`, `output`, `procedure`, `options` and `defaults` keys.
+    :raises ValueError: If a job is missing its file or procedure.
+    """
+    options: Dict[str, object] = {}
+    for option in arguments.option:
+        option_name, _, option_value = option.partition('=')
+        try:
+            options[option_name] = json.loads(option_value)
+        except json.JSONDecodeError:
+            options[option_name] = option_value
+
+    jobs: List[Dict[str, object]] = [
+        {'file': file, 'procedure': arguments.procedure, 'options': dict(options)}
+        for file in arguments.files
+    ]
+    if arguments.jobs:
+        with open(arguments.jobs) as jobs_file:
+            jobs += [json.loads(line) for line in jobs_file if line.strip()]
+
+    for job in jobs:
+        if not job.get('file') or not job.get('procedure'):
+            raise ValueError(f"Job needs both a file and a procedure: {job}")
+
+        job['file'] = os.path.abspath(job['file'])
+        if not job.get('output'):
+            file_stem, file_extension = os.path.splitext(os.path.basename(job['file']))
+            job['output'] = os.path.join(
+                arguments.output_dir or os.path.dirname(job['file']),
+                f"{file_stem}{arguments.suffix}{file_extension}"
+            )
+        job['output'] = os.path.abspath(job['output'])
+        job['defaults'] = dict(DEFAULT_OPTIONS)
+
+    return jobs
+
+
+def worker_died_result(
+    job: Dict[str, object],
+    error: str,
+    time_start: float,
+) -> Dict[str, object]:
+    """
+    Builds the result for a job that couldn't be finished, as its worker died.
+
+    :param job: The job.
+    :param error: Why the worker died, if known.
+    :param time_start: When the job was started, from `time.perf_counter`.
+    :return: The job's result.
+    """
+    return {
+        'file': job['file'], 'output': job['output'],
+        'status': 'WORKER_DIED', 'error': error, 'seconds': 0.0,
+        'wall_seconds': time.perf_counter() - time_start,
+    }
+
+
+def accept_worker(
+    server: socket.socket,
+    authkey: bytes,
+) -> Tuple[Connection, int]:
+    """
+    Accepts a connection from a worker, checks it has the key, and finds out which worker it is.
+
+    :param server: The socket the workers connect to.
+    :param authkey: The key shared with the workers.
+    :return: The connection, and the index of the worker.
+    :raises AuthenticationError: If the connection doesn't have the key.
+    """
+    worker_socket, _ = server.accept()
+    worker_socket.setblocking(True)
+    connection = Connection(worker_socket.detach())
+    try:
+        deliver_challenge(connection, authkey)
+        answer_challenge(connection, authkey)
+        return connection, connection.recv()
+    except Exception:
+        connection.close()
+        raise
+
+
+def feed_worker(
+    connection: Connection,
+    process: subprocess.Popen,
+    jobs: queue.Queue,
+    results: List[Dict[str, object]],
+    verbose: bool,
+):
+    """
+    Keeps a connected worker busy until the queue is empty, or the worker dies.
+
+    :param connection: The connection to the worker.
+    :param process: The worker's GIMP console process.
+    :param jobs: The queue of jobs still to run.
+    :param results: The list to add each job's result to.
+    :param verbose: Whether to print each result as it comes in.
+    """
+    with connection:
+        while True:
+            try:
+                job = jobs.get_nowait()
+            except queue.Empty:
+                connection.send(None)
+                return
+
+            time_start: float = time.perf_counter()
+            try:
+                connection.send(job)
+                # Don't wait forever on a worker that's exited without closing the connection.
+                while not connection.poll(POLL_SECONDS):
+                    if process.poll() is not None:
+                        raise EOFError(f"GIMP exited with code {process.returncode}")
+                result = connection.recv()
+            except (EOFError, OSError) as e:
+                # The worker has died, so the job can't be finished here; the others carry on with the queue.
+                results.append(worker_died_result(job, f"{e}" or "Worker closed the connection", time_start))
+                return
+
+            result['wall_seconds'] = time.perf_counter() - time_start
+            results.append(result)
+            if verbose:
+                print(f"{result['status']:>16} {result['seconds']:8.2f}s {result['file']}")
+
+
+def run_batch(
+    jobs: List[Dict[str, object]],
+    gimp_console: str,
+    workers: int,
+    verbose: bool,
+) -> List[Dict[str, object]]:
+    """
+    Runs the jobs over a pool of GIMP console workers.
+
+    Workers that exit, or don't connect back within `CONNECT_TIMEOUT_SECONDS`, are given up on,
+    and their jobs left to the others. If no workers are left, the remaining jobs fail with `WORKER_DIED`.
+
+    :param jobs: The jobs to run.
+    :param gimp_console: The path to the GIMP console executable.
+    :param workers: The number of workers to start.
+    :param verbose: Whether to print each result as it comes in.
+    :return: The result of each job, in the order they finished.
+    """
+    job_queue: queue.Queue = queue.Queue()
+    for job in jobs:
+        job_queue.put(job)
+
+    workers = max(1, min(workers, len(jobs)))
+    authkey: bytes = secrets.token_bytes(32)
+    results: List[Dict[str, object]] = []
+
+    with socket.create_server(('localhost', 0), backlog=workers) as server:
+        worker_environment: Dict[str, str] = dict(os.environ, **{AUTHKEY_VARIABLE: authkey.hex()})
+        processes: List[subprocess.Popen] = [
+            subprocess.Popen(
+                [
+                    gimp_console, '--no-interface', '--no-data', '--no-fonts',
+                    '--batch-interpreter=python-fu-eval', '--batch',
+                    WORKER_CODE.format(
+                        plugin_dir=PLUGIN_DIR, port=server.getsockname()[1],
+                        variable=AUTHKEY_VARIABLE, worker_index=worker_index,
+                    ),
+                    '--quit'
+                ],
+                env=worker_environment,
+            )
+            for worker_index in range(workers)
+        ]
+
+        # Accept each worker as it connects, until they all have, or have died or timed out.
+        threads: List[threading.Thread] = []
+        connected: Set[int] = set()
+        deadline: float = time.monotonic() + CONNECT_TIMEOUT_SECONDS
+        while True:
+            waiting: List[int] = [
+                worker_index for worker_index, process in enumerate(processes)
+                if worker_index not in connected and process.poll() is None
+            ]
+            if not waiting or (job_queue.empty() and not any(thread.is_alive() for thread in threads)):
+                break
+            if time.monotonic() > deadline:
+                print(f"{len(waiting)} workers didn't connect in {CONNECT_TIMEOUT_SECONDS:.0f}s.", file=sys.stderr)
+                break
+
+            readable, _, _ = select.select([server], [], [], POLL_SECONDS)
+            if not readable:
+                continue
+            try:
+                connection, worker_index = accept_worker(server, authkey)
+            except (AuthenticationError, EOFError, OSError) as e:
+                print(f"Rejected a connection: {e}", file=sys.stderr)
+                continue
+
+            connected.add(worker_index)
+            thread = threading.Thread(
+                target=feed_worker,
+                args=(connection, processes[worker_index], job_queue, results, verbose)
+            )
+            thread.start()
+            threads.append(thread)
+
+        # Each thread returns once its worker finishes or exits, so this can't hang on a dead worker.
+        for thread in threads:
+            thread.join()
+
+    for worker_index, process in enumerate(processes):
+        if worker_index not in connected and process.poll() is not None:
+            print(
+                f"Worker {worker_index} exited with code {process.returncode} before connecting.", file=sys.stderr
+            )
+
+    time_start: float = time.perf_counter()
+    while True:
+        try:
+            job = job_queue.get_nowait()
+        except queue.Empty:
+            break
+        results.append(worker_died_result(job, "No workers left to run it", time_start))
+
+    for process in processes:
+        try:
+            process.wait(timeout=CONNECT_TIMEOUT_SECONDS if process.poll() is None else None)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    return results
+
+
+def main() -> int:
+    """
+    Runs the batch from the command line.
+
+    :return: The exit code; 1 if any job failed.
+    """
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('files', nargs='*', help="Files to run the procedure on.")
+    parser.add_argument('--jobs', help="JSON-lines file of jobs.")
+    parser.add_argument('--procedure', default='ttt-palette-swap-simple', help="Procedure to run on the files.")
+    parser.add_argument('--option', action='append', default=[], metavar='NAME=VALUE', help="Procedure argument, as a JSON value or plain string. Layer arguments are given by name.")
+    parser.add_argument('--output-dir', help="Directory to save outputs in. Defaults to alongside the inputs.")
+    parser.add_argument('--suffix', default='-swapped', help="Suffix added to output filenames.")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Number of GIMP workers to run at once.")
+    parser.add_argument('--gimp', default=find_gimp_console(), help="Path to the GIMP console executable.")
+    parser.add_argument('--report', help="File to write the results of every job to, as JSON.")
+    parser.add_argument('--quiet', action='store_true', help="Don't print each result as it finishes.")
+    arguments = parser.parse_args()
+
+    if not arguments.gimp:
+        parser.error("Can't find the GIMP console, please give it with --gimp.")
+
+    jobs = read_jobs(arguments)
+    if not jobs:
+        parser.error("No jobs to run.")
+    if arguments.output_dir:
+        os.makedirs(arguments.output_dir, exist_ok=True)
+
+    time_start: float = time.perf_counter()
+    results = run_batch(jobs, arguments.gimp, arguments.workers, not arguments.quiet)
+    time_total: float = time.perf_counter() - time_start
+
+    failures: int = len(jobs) - sum(result['status'] == 'SUCCESS' for result in results)
+    print(
+        f"Ran {len(jobs)} jobs in {time_total:.2f}s on {min(arguments.workers, len(jobs))} workers, "
+        f"{failures} failed."
+    )
+    for result in results:
+        if result['status'] != 'SUCCESS':
+            print(f"{result['status']}: {result['file']}: {result['error']}", file=sys.stderr)
+
+    if arguments.report:
+        with open(arguments.report, 'w') as report_file:
+            json.dump(results, report_file, indent=2)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -2,7 +2,7 @@
 # -*- coding: utf-8 -*-
 
 import sys
-from typing import List
+from typing import List, Optional
 
 import gi
 gi.require_version('Gimp', '3.0')
@@ -24,11 +24,38 @@ from gi.repository import GLib
 # -------------
 
 import palette_swap
+import palette_swap.engine
+import palette_swap.palette_arrays
+import palette_swap.palette_gradient_map
 import palette_swap.palette_swap_linear
+import palette_swap.palette_swap_regions
 import palette_swap.palette_swap_simple
 import palette_swap.palette_to_layer
 
 
+ENGINE_LABELS: dict[str, str] = {
+    'auto': "Automatic",
+    'select-fill': "Select and fill each colour",
+    'lut': "Rewrite pixels",
+    'tiled': "Rewrite pixels, repeated tiles once",
+    'parallel': "Rewrite pixels, across processes",
+    'indexed': "Edit the colormap (indexed images)",
+}
+
+
+def engine_choice(engines: List[str]) -> Gimp.Choice:
+    """
+    Builds the list of engines for a procedure's 'engine' argument.
+
+    :param engines: The engines the procedure can use, as in `palette_swap.engine`.
+    :return: The choice, with 'auto' first.
+    """
+    choice = Gimp.Choice.new()
+    for index_engine, engine in enumerate(['auto'] + engines):
+        choice.add(engine, index_engine, ENGINE_LABELS[engine], "")
+    return choice
+
+
 # I really don't understand why you can't register two plugin objects?
 # This whole plugin setup is very bizarre.
 
@@ -39,10 +66,15 @@ class PaletteSwapLinearMetaPlugin:
     name: str = 'ttt-palette-swap-linear'
     menu_label: str = "Swap from old to new palette..."
     menu_path: str = "<Image>/Filters/Map/Palette Swap"
+    image_types: str = "RGB*, INDEXED*"
     documentation: str = "Maps the colours from 1-pixel 'old' palette layer to an equivalent 'new' layer,\nthen replaces all the 'old' colours in the current layer with the corresponding 'new' colours."
     dialog_fill: List[str] = [
         'layer-palette-old',
         'layer-palette-new',
+        'tile-size',
+        'workers',
+        'engine',
+        'incremental',
     ]
 
     @classmethod
@@ -70,6 +102,35 @@ class PaletteSwapLinearMetaPlugin:
             none_ok=False,
             flags=GObject.ParamFlags.READWRITE
         )
+        procedure.add_int_argument(
+            name="tile-size",
+            nick="Tile size",
+            blurb="Size of the repeated tiles in sprite sheets and tilemaps. When set, repeated tiles can be processed only once. 0 if the layer is not made of tiles.",
+            min=0, max=GLib.MAXINT, value=0,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_int_argument(
+            name="workers",
+            nick="Worker processes",
+            blurb="Number of processes to split very large layers across when reading or rewriting pixels. 0 for one per core, 1 to stay in a single process.",
+            min=0, max=256, value=0,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_choice_argument(
+            name="engine",
+            nick="Engine",
+            blurb="How to swap the palette. Automatic picks the fastest for the layer.",
+            choice=engine_choice(palette_swap.engine.ENGINES),
+            value="auto",
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_boolean_argument(
+            name="incremental",
+            nick="Only re-swap edited areas",
+            blurb="Remember this swap, and when re-run with the same settings only re-swap the parts of the layer edited since.",
+            value=False,
+            flags=GObject.ParamFlags.READWRITE
+        )
 
     @classmethod
     def run(
@@ -133,11 +194,15 @@ class PaletteSwapLinearMetaPlugin:
                 layer_target=image.get_selected_layers()[0],
                 layer_palette_old=layer_palette_old,
                 layer_palette_new=layer_palette_new,
+                tile_size=config.get_property("tile-size"),
+                workers=config.get_property("workers"),
+                engine=config.get_property("engine"),
+                incremental=config.get_property("incremental"),
             )
         except Exception as e:
             Gimp.message(f"{e}")
             return procedure.new_return_values(
-                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error()
+                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(f"{e}")
             )
         # print("Done!")
         return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
@@ -150,12 +215,17 @@ class PaletteSwapSimpleMetaPlugin:
     name: str = 'ttt-palette-swap-simple'
     menu_label: str = "Swap to sample layer's palette..."
     menu_path: str = "<Image>/Filters/Map/Palette Swap"
+    image_types: str = "RGB*, INDEXED*"
     documentation: str = "Ranks colours in the current layer by brightness,\nranks colours in the sample layer by brightness,\nthen replaces colours colours in the current layer with their equivalent rank in the sample."
     dialog_fill: List[str] = [
         'layer-sample',
         'count-threshold',
         'include-transparent',
         'light-first',
+        'tile-size',
+        'workers',
+        'engine',
+        'incremental',
     ]
 
     @classmethod
@@ -197,6 +267,35 @@ class PaletteSwapSimpleMetaPlugin:
             value=False,
             flags=GObject.ParamFlags.READWRITE
         )
+        procedure.add_int_argument(
+            name="tile-size",
+            nick="Tile size",
+            blurb="Size of the repeated tiles in sprite sheets and tilemaps. When set, repeated tiles can be processed only once. 0 if the layer is not made of tiles.",
+            min=0, max=GLib.MAXINT, value=0,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_int_argument(
+            name="workers",
+            nick="Worker processes",
+            blurb="Number of processes to split very large layers across when reading or rewriting pixels. 0 for one per core, 1 to stay in a single process.",
+            min=0, max=256, value=0,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_choice_argument(
+            name="engine",
+            nick="Engine",
+            blurb="How to swap the palette. Automatic picks the fastest for the layer.",
+            choice=engine_choice(palette_swap.engine.ENGINES),
+            value="auto",
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_boolean_argument(
+            name="incremental",
+            nick="Only re-swap edited areas",
+            blurb="Remember this swap, and when re-run with the same settings only re-swap the parts of the layer edited since.",
+            value=False,
+            flags=GObject.ParamFlags.READWRITE
+        )
 
     @classmethod
     def run(
@@ -245,12 +344,16 @@ class PaletteSwapSimpleMetaPlugin:
                 layer_sample=config.get_property("layer-sample"),
                 include_transparent=config.get_property("include-transparent"),
                 light_first=config.get_property("light-first"),
-                count_threshold=config.get_property("count-threshold")
+                count_threshold=config.get_property("count-threshold"),
+                tile_size=config.get_property("tile-size"),
+                workers=config.get_property("workers"),
+                engine=config.get_property("engine"),
+                incremental=config.get_property("incremental"),
             )
         except Exception as e:
             Gimp.message(f"{e}")
             return procedure.new_return_values(
-                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error()
+                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(f"{e}")
             )
 
         # print("Done!")
@@ -269,6 +372,9 @@ class PaletteToLayerMetaPlugin:
         'count-threshold',
         'include-transparent',
         'layer-name',
+        'tile-size',
+        'workers',
+        'engine',
     ]
 
     @classmethod
@@ -303,6 +409,28 @@ class PaletteToLayerMetaPlugin:
             value="Palette",
             flags=GObject.ParamFlags.READWRITE,
         )
+        procedure.add_int_argument(
+            name="tile-size",
+            nick="Tile size",
+            blurb="If set, counts repeated tiles of this size only once. Useful for sprite sheets and tilemaps. 0 to count every pixel.",
+            min=0, max=GLib.MAXINT, value=0,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_int_argument(
+            name="workers",
+            nick="Worker processes",
+            blurb="Number of processes to split very large layers across when reading or rewriting pixels. 0 for one per core, 1 to stay in a single process.",
+            min=0, max=256, value=0,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_choice_argument(
+            name="engine",
+            nick="Engine",
+            blurb="How to read the layer. Automatic picks the fastest for the layer.",
+            choice=engine_choice(palette_swap.engine.ENGINES_EXTRACT),
+            value="auto",
+            flags=GObject.ParamFlags.READWRITE
+        )
 
     @classmethod
     def run(
@@ -353,11 +481,14 @@ class PaletteToLayerMetaPlugin:
                 include_transparent=config.get_property("include-transparent"),
                 count_threshold=config.get_property("count-threshold"),
                 layer_name=config.get_property("layer-name"),
+                tile_size=config.get_property("tile-size"),
+                workers=config.get_property("workers"),
+                engine=config.get_property("engine"),
             )
         except Exception as e:
             Gimp.message(f"{e}")
             return procedure.new_return_values(
-                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error()
+                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(f"{e}")
             )
 
         # print("Done!")
@@ -365,10 +496,419 @@ class PaletteToLayerMetaPlugin:
         return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
 
 
+class PaletteGradientMapMetaPlugin:
+    """
+    Maps the brightness of the current layer onto the palette auto-detected from another layer.
+    """
+    name: str = 'ttt-palette-gradient-map'
+    menu_label: str = "Gradient map to sample layer's palette..."
+    menu_path: str = "<Image>/Filters/Map/Palette Swap"
+    documentation: str = "Ranks colours in the sample layer by brightness and blends between them,\nthen recolours each pixel in the current layer by its brightness.\nWorks on layers with many colours, like shaded or painted art."
+    dialog_fill: List[str] = [
+        'layer-sample',
+        'count-threshold',
+        'include-transparent',
+        'lut-size',
+        'tile-size',
+        'workers',
+    ]
+
+    @classmethod
+    def arguments(
+            cls: 'PaletteGradientMapMetaPlugin',
+            procedure: Gimp.ImageProcedure
+    ):
+        """
+        Adds arguments specific to this meta-plugin.
+
+        :param cls: This class.
+        :param procedure: The procedure to add arguments to.
+        """
+        procedure.add_layer_argument(
+            name="layer-sample",
+            nick="Sample Layer",
+            blurb="Layer to sample colours from.",
+            none_ok=False,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_boolean_argument(
+            name="include-transparent",
+            nick="Sample transparent pixels",
+            blurb="Whether or not to sample and recolour transparent pixels.",
+            value=True,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_int_argument(
+            name="count-threshold",
+            nick="Pixel count threshold",
+            blurb="Ignore sample colours with less than this many pixels. May solve problems with rogue wrong-coloured pixels messing up palette detection.",
+            min=0, max=GLib.MAXINT, value=5,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_int_argument(
+            name="lut-size",
+            nick="Brightness steps",
+            blurb="How many steps of brightness to blend the palette into.",
+            min=2, max=65536, value=256,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_int_argument(
+            name="tile-size",
+            nick="Tile size",
+            blurb="If set, processes repeated tiles of this size only once. Useful for sprite sheets and tilemaps. 0 to process every pixel.",
+            min=0, max=GLib.MAXINT, value=0,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_int_argument(
+            name="workers",
+            nick="Worker processes",
+            blurb="Number of processes to split very large layers across when reading or rewriting pixels. 0 for one per core, 1 to stay in a single process.",
+            min=0, max=256, value=0,
+            flags=GObject.ParamFlags.READWRITE
+        )
+
+    @classmethod
+    def run(
+            cls, procedure, run_mode, image, drawables, config, run_data
+    ):
+        """
+        The method called when the menu shortcut is run.
+
+        :param cls: This class.
+        :param procedure: The procedure being called.
+        :param run_mode: Whether it's interactive or not.
+        :param image: The current image.
+        :param drawables: ...not used this?
+        :param config: The config values for the procedure.
+        :param run_data: ...not used this?
+        :return: The return values generated by the procedure.
+        """
+        if run_mode == Gimp.RunMode.INTERACTIVE:
+            gi.require_version('Gtk', '3.0')
+
+            GimpUi.init(cls.name)
+            dialog = GimpUi.ProcedureDialog.new(procedure, config, cls.menu_label)
+            dialog.get_label(
+                f'{cls.name}-docs',
+                cls.documentation,
+                False,
+                False,
+            )
+            dialog.fill([f'{cls.name}-docs']+cls.dialog_fill)
+            if not dialog.run():
+                return procedure.new_return_values(
+                    Gimp.PDBStatusType.CANCEL, GLib.Error()
+                )
+
+        try:
+            palette_swap.palette_gradient_map.palette_gradient_map(
+                image,
+                layer_target=image.get_selected_layers()[0],
+                layer_sample=config.get_property("layer-sample"),
+                include_transparent=config.get_property("include-transparent"),
+                count_threshold=config.get_property("count-threshold"),
+                lut_size=config.get_property("lut-size"),
+                tile_size=config.get_property("tile-size"),
+                workers=config.get_property("workers"),
+            )
+        except Exception as e:
+            Gimp.message(f"{e}")
+            return procedure.new_return_values(
+                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(f"{e}")
+            )
+
+        return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
+
+
+class PaletteExtractMetaPlugin:
+    """
+    Returns the palette of a layer as arrays, for use from scripts.
+    """
+    name: str = 'ttt-palette-extract'
+    menu_label: Optional[str] = None
+    menu_path: Optional[str] = None
+    documentation: str = "Finds the colours within the given layer, sorted from darkest to lightest,\nand returns them as 8-bit R'G'B' bytes along with their pixel counts and brightness.\nIntended for use from scripts and other plug-ins."
+    dialog_fill: List[str] = []
+
+    @classmethod
+    def arguments(
+            cls: 'PaletteExtractMetaPlugin',
+            procedure: Gimp.ImageProcedure
+    ):
+        """
+        Adds arguments specific to this meta-plugin.
+
+        :param cls: This class.
+        :param procedure: The procedure to add arguments to.
+        """
+        procedure.add_boolean_argument(
+            name="include-transparent",
+            nick="Sample transparent pixels",
+            blurb="Whether or not to sample colours from transparent pixels.",
+            value=True,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_int_argument(
+            name="count-threshold",
+            nick="Pixel count threshold",
+            blurb="Ignore colours with less than this many pixels. May solve problems with rogue wrong-coloured pixels messing up palette detection.",
+            min=0, max=GLib.MAXINT, value=5,
+            flags=GObject.ParamFlags.READWRITE
+        )
+
+    @classmethod
+    def return_values(
+            cls: 'PaletteExtractMetaPlugin',
+            procedure: Gimp.ImageProcedure
+    ):
+        """
+        Adds return values specific to this meta-plugin.
+
+        :param cls: This class.
+        :param procedure: The procedure to add return values to.
+        """
+        procedure.add_int32_array_return_value(
+            name="counts",
+            nick="Pixel counts",
+            blurb="The number of pixels of each colour.",
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_double_array_return_value(
+            name="brightness",
+            nick="Brightness",
+            blurb="The perceptual brightness of each colour.",
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_bytes_return_value(
+            name="palette-bytes",
+            nick="Palette bytes",
+            blurb="The colours in the layer, sorted from darkest to lightest, as 8-bit R'G'B' triples.",
+            flags=GObject.ParamFlags.READWRITE
+        )
+
+    @classmethod
+    def run(
+            cls, procedure, run_mode, image, drawables, config, run_data
+    ):
+        """
+        The method called when the procedure is run.
+
+        :param cls: This class.
+        :param procedure: The procedure being called.
+        :param run_mode: Whether it's interactive or not.
+        :param image: The current image.
+        :param drawables: The layers passed by the caller. Uses the first.
+        :param config: The config values for the procedure.
+        :param run_data: ...not used this?
+        :return: The return values generated by the procedure.
+        """
+        layer_sample: Gimp.Layer = drawables[0] if drawables else image.get_selected_layers()[0]
+
+        try:
+            colours, counts, brightness = palette_swap.palette_arrays.palette_to_arrays(
+                layer_sample=layer_sample,
+                include_transparent=config.get_property("include-transparent"),
+                count_threshold=config.get_property("count-threshold"),
+            )
+            palette_bytes: bytes = palette_swap.palette_arrays.palette_to_bytes(colours)
+
+            value_counts = GObject.Value(Gimp.Int32Array)
+            Gimp.value_set_int32_array(value_counts, counts)
+            value_brightness = GObject.Value(Gimp.DoubleArray)
+            Gimp.value_set_double_array(value_brightness, brightness)
+            value_bytes = GObject.Value(GLib.Bytes, GLib.Bytes.new(palette_bytes))
+        except Exception as e:
+            Gimp.message(f"{e}")
+            return procedure.new_return_values(
+                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(f"{e}")
+            )
+
+        return_values = procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
+        for index_value, value in enumerate(
+            [value_counts, value_brightness, value_bytes], start=1
+        ):
+            return_values.remove(index_value)
+            return_values.insert(index_value, value)
+        return return_values
+
+
+class PaletteSwapArraysMetaPlugin:
+    """
+    Swaps the current layer from one colour array to another, for use from scripts.
+    """
+    name: str = 'ttt-palette-swap-arrays'
+    menu_label: Optional[str] = None
+    menu_path: Optional[str] = None
+    documentation: str = "Replaces each colour in the 'old' colour array with the matching colour in the 'new' array.\nDoes not open an undo group or flush the displays.\nIntended for use from scripts and other plug-ins."
+    dialog_fill: List[str] = []
+
+    @classmethod
+    def arguments(
+            cls: 'PaletteSwapArraysMetaPlugin',
+            procedure: Gimp.ImageProcedure
+    ):
+        """
+        Adds arguments specific to this meta-plugin.
+
+        :param cls: This class.
+        :param procedure: The procedure to add arguments to.
+        """
+        procedure.add_color_array_argument(
+            name="palette-old",
+            nick="Old Palette",
+            blurb="Colours to be replaced.",
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_color_array_argument(
+            name="palette-new",
+            nick="New Palette",
+            blurb="Colours to replace them with.",
+            flags=GObject.ParamFlags.READWRITE
+        )
+
+    @classmethod
+    def run(
+            cls, procedure, run_mode, image, drawables, config, run_data
+    ):
+        """
+        The method called when the procedure is run.
+
+        :param cls: This class.
+        :param procedure: The procedure being called.
+        :param run_mode: Whether it's interactive or not.
+        :param image: The current image.
+        :param drawables: The layers passed by the caller. Uses the first.
+        :param config: The config values for the procedure.
+        :param run_data: ...not used this?
+        :return: The return values generated by the procedure.
+        """
+        layer_target: Gimp.Layer = drawables[0] if drawables else image.get_selected_layers()[0]
+
+        try:
+            palette_swap.palette_arrays.palette_swap_arrays(
+                image,
+                layer_target=layer_target,
+                palette_old=config.get_property("palette-old"),
+                palette_new=config.get_property("palette-new"),
+            )
+        except ValueError as e:
+            Gimp.message(f"{e}")
+            return procedure.new_return_values(
+                Gimp.PDBStatusType.CALLING_ERROR, GLib.Error(f"{e}")
+            )
+        except Exception as e:
+            Gimp.message(f"{e}")
+            return procedure.new_return_values(
+                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(f"{e}")
+            )
+
+        return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
+
+
+class PaletteSwapRegionsMetaPlugin:
+    """
+    Swaps several masked regions of the current layer, each between its own pair of palettes, for use from scripts.
+    """
+    name: str = 'ttt-palette-swap-regions'
+    menu_label: Optional[str] = None
+    menu_path: Optional[str] = None
+    documentation: str = "For each mask, maps the colours from its 1-pixel 'old' palette layer to its 'new' palette layer,\nthen replaces the 'old' colours with the 'new' within the mask, all in a single pass.\nIntended for use from scripts and other plug-ins."
+    dialog_fill: List[str] = []
+
+    @classmethod
+    def arguments(
+            cls: 'PaletteSwapRegionsMetaPlugin',
+            procedure: Gimp.ImageProcedure
+    ):
+        """
+        Adds arguments specific to this meta-plugin.
+
+        :param cls: This class.
+        :param procedure: The procedure to add arguments to.
+        """
+        procedure.add_core_object_array_argument(
+            name="masks",
+            nick="Region Masks",
+            blurb="Channels selecting each region, or the layer's own mask. Pixels belong to the first region they're selected in.",
+            object_type=Gimp.Channel.__gtype__,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_core_object_array_argument(
+            name="layers-palette-old",
+            nick="Old Palette Layers",
+            blurb="1-pixel high layers containing colours to be replaced, one per region.",
+            object_type=Gimp.Layer.__gtype__,
+            flags=GObject.ParamFlags.READWRITE
+        )
+        procedure.add_core_object_array_argument(
+            name="layers-palette-new",
+            nick="New Palette Layers",
+            blurb="1-pixel high layers containing colours to replace them with, one per region.",
+            object_type=Gimp.Layer.__gtype__,
+            flags=GObject.ParamFlags.READWRITE
+        )
+
+    @classmethod
+    def run(
+            cls, procedure, run_mode, image, drawables, config, run_data
+    ):
+        """
+        The method called when the procedure is run.
+
+        :param cls: This class.
+        :param procedure: The procedure being called.
+        :param run_mode: Whether it's interactive or not.
+        :param image: The current image.
+        :param drawables: The layers passed by the caller. Uses the first.
+        :param config: The config values for the procedure.
+        :param run_data: ...not used this?
+        :return: The return values generated by the procedure.
+        """
+        layer_target: Gimp.Layer = drawables[0] if drawables else image.get_selected_layers()[0]
+        layers_palette_old: List[Gimp.Layer] = config.get_core_object_array('layers-palette-old')
+        layers_palette_new: List[Gimp.Layer] = config.get_core_object_array('layers-palette-new')
+
+        invalid_layers: bool = False
+        for layer_palette in layers_palette_old + layers_palette_new:
+            if layer_palette.get_height() != 1:
+                Gimp.message(f"{layer_palette.get_name()} is not 1-pixel high!")
+                invalid_layers = True
+
+        if invalid_layers:
+            return procedure.new_return_values(
+                Gimp.PDBStatusType.CALLING_ERROR, GLib.Error()
+            )
+
+        try:
+            palette_swap.palette_swap_regions.palette_swap_regions(
+                image,
+                layer_target=layer_target,
+                masks=config.get_core_object_array('masks'),
+                layers_palette_old=layers_palette_old,
+                layers_palette_new=layers_palette_new,
+            )
+        except ValueError as e:
+            Gimp.message(f"{e}")
+            return procedure.new_return_values(
+                Gimp.PDBStatusType.CALLING_ERROR, GLib.Error(f"{e}")
+            )
+        except Exception as e:
+            Gimp.message(f"{e}")
+            return procedure.new_return_values(
+                Gimp.PDBStatusType.EXECUTION_ERROR, GLib.Error(f"{e}")
+            )
+
+        return procedure.new_return_values(Gimp.PDBStatusType.SUCCESS, GLib.Error())
+
+
 PROCEDURES: dict[str, object] = {
     'ttt-palette-swap-simple': PaletteSwapSimpleMetaPlugin,
     'ttt-palette-swap-linear': PaletteSwapLinearMetaPlugin,
     'ttt-palette-to-layer':PaletteToLayerMetaPlugin,
+    'ttt-palette-gradient-map': PaletteGradientMapMetaPlugin,
+    'ttt-palette-extract': PaletteExtractMetaPlugin,
+    'ttt-palette-swap-arrays': PaletteSwapArraysMetaPlugin,
+    'ttt-palette-swap-regions': PaletteSwapRegionsMetaPlugin,
 }
 
 
@@ -399,9 +939,10 @@ class PaletteSwapPlugin(Gimp.PlugIn):
             PROCEDURES[name].run,
             None,
         )
-        procedure.set_image_types("RGBA")
-        procedure.set_menu_label(PROCEDURES[name].menu_label)
-        procedure.add_menu_path(PROCEDURES[name].menu_path)
+        procedure.set_image_types(getattr(PROCEDURES[name], 'image_types', "RGBA"))
+        if PROCEDURES[name].menu_label:
+            procedure.set_menu_label(PROCEDURES[name].menu_label)
+            procedure.add_menu_path(PROCEDURES[name].menu_path)
         procedure.set_documentation(
             PROCEDURES[name].documentation,
             PROCEDURES[name].documentation,
@@ -412,8 +953,12 @@ class PaletteSwapPlugin(Gimp.PlugIn):
         )
         # print(f"Adding arguments")
         PROCEDURES[name].arguments(procedure)
+        if hasattr(PROCEDURES[name], 'return_values'):
+            PROCEDURES[name].return_values(procedure)
         # print(f"Procedure finished")
         return procedure
 
 
-Gimp.main(PaletteSwapPlugin.__gtype__, sys.argv)
+# Worker processes re-import this script, so they mustn't start the plug-in too.
+if __name__ == '__main__':
+    Gimp.main(PaletteSwapPlugin.__gtype__, sys.argv)